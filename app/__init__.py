@@ -13,6 +13,14 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = True
 app.config["UP_DIR"] = os.path.join(os.path.abspath(os.path.dirname(__file__)), "static/uploads/")
 app.config["SECRET_KEY"] = "12345678"
 app.config["REDIS_URL"] = "redis://@localhost:6379/0"
+app.config["CATALOG_SNAPSHOT"] = True  # 首页使用内存列式快照（需要 numpy）
+app.config["DANMAKU_MAX_COUNT"] = 10000  # 每部电影默认最多保留的弹幕条数，0 为不限
+app.config["DANMAKU_MAX_AGE"] = 0  # 弹幕默认保留的秒数，0 为不限
+app.config["DANMAKU_RATE"] = 1  # 每个 ip 在每部电影中每秒可发送的弹幕数
+app.config["DANMAKU_BURST"] = 5  # 允许连续发送的弹幕数
+app.config["MEDIA_OFFLOAD"] = None  # 视频交给前端服务器发送："x-accel"（nginx）或 "x-sendfile"（Apache）
+app.config["MEDIA_ACCEL_PREFIX"] = "/protected-uploads/"  # nginx 中映射到 UP_DIR 的 internal location
+app.config["THUMB_WORKERS"] = 2  # 生成缩略图的进程数（需要 Pillow）
 app.debug = True
 db = SQLAlchemy(app)
 rd = FlaskRedis(app)
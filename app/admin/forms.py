@@ -1,6 +1,7 @@
 # coding:utf8
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, FileField, TextAreaField, SelectField, SelectMultipleField
+from wtforms import StringField, PasswordField, SubmitField, FileField, TextAreaField, SelectField, SelectMultipleField, \
+    HiddenField
 from wtforms.validators import DataRequired, ValidationError, EqualTo
 from app.models import Admin, Tag, Auth, Role
 
@@ -70,6 +71,42 @@ class Tagform(FlaskForm):
     )
 
 
+class SensitiveWordForm(FlaskForm):
+    words = TextAreaField(
+        label="敏感词",
+        validators=[
+            DataRequired("请输入敏感词")
+        ],
+        description="敏感词",
+        render_kw={
+            "class": "form-control",
+            "rows": 10,
+            "id": "input_words",
+            "placeholder": "每行一个敏感词，已存在的词会更新处理方式",
+            "required": False,
+        }
+    )
+    policy = SelectField(
+        label="处理方式",
+        validators=[
+            DataRequired("请选择处理方式")
+        ],
+        coerce=int,
+        choices=[(1, "替换为*"), (2, "标记待审"), (3, "拒绝发送")],
+        description="处理方式",
+        render_kw={
+            "class": "form-control",
+            "id": "input_policy",
+        }
+    )
+    submit = SubmitField(
+        '添加',
+        render_kw={
+            "class": "btn btn-primary",
+        }
+    )
+
+
 class TagEditform(FlaskForm):
     name = StringField(
         label="名称",
@@ -129,6 +166,9 @@ class Movieform(FlaskForm):
             "required": False
         }
     )
+    # 分块上传完成后的上传编号，提交时代替 url/logo 中的文件
+    url_upload = HiddenField()
+    logo_upload = HiddenField()
     star = SelectField(
         label="星级",
         validators=[
@@ -167,12 +207,9 @@ class Movieform(FlaskForm):
     )
     length = StringField(
         label="片长",
-        validators=[
-            DataRequired("请输入片长")
-        ],
         description="片长",
         render_kw={
-            "class": "form-control", "placeholder": "请输入片长！",
+            "class": "form-control", "placeholder": "请输入片长，上传 MP4 时留空可自动读取",
             "required": False}
     )
     release_time = StringField(
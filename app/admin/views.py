@@ -1,17 +1,21 @@
+import json
 import os
-import uuid
 from functools import wraps
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 
 from werkzeug.utils import secure_filename
 
-from app import db, app
+from app import db, app, cache, comments, danmaku_io, facets, fulltext, mp4, storage, thumbs, \
+    uploads, wordfilter
 from app.admin import admin
-from flask import render_template, redirect, url_for, flash, session, request, abort
+from flask import render_template, redirect, url_for, flash, session, request, abort, Response
+from sqlalchemy.orm import contains_eager, joinedload
 
-from app.admin.forms import LoginForm, Tagform, Movieform, PreviewForm, PwdForm, Authform, Roleform, AdminForm
-from app.models import Admin, Tag, Movie, Preview, User, Comment, MovieCol, OpLog, AdminLog, UserLog, Auth, Role
+from app.admin.forms import LoginForm, Tagform, Movieform, PreviewForm, PwdForm, Authform, Roleform, AdminForm, \
+    SensitiveWordForm
+from app.models import Admin, Tag, Movie, Preview, User, Comment, MovieCol, OpLog, AdminLog, UserLog, Auth, Role, \
+    Danmaku, SensitiveWord
 
 __author__ = "TuDi"
 __date__ = "2018/3/29 下午11:44"
@@ -46,6 +50,8 @@ def access_control(f):
         ).filter(
             Role.id == Admin.role_id,
             Admin.id == session["admin_id"]
+        ).options(
+            contains_eager(Admin.role)
         ).first()
         auths = admin.role.auths
         auths = list(map(lambda v: int(v), auths.split(",")))
@@ -59,9 +65,16 @@ def access_control(f):
     return decor
 
 
-def change_filename(file_name):
-    info = os.path.splitext(file_name)
-    return datetime.now().strftime("%Y%m%d%H%M%S") + str(uuid.uuid4().hex) + info[-1]
+def set_video_meta(movie, meta, replace=False):
+    # 写入自动读取的视频信息；片长只在未填写时（或更换了视频时）使用读取到的时长
+    if not meta:
+        return
+    movie.duration = meta["duration"]
+    movie.width = meta["width"]
+    movie.height = meta["height"]
+    movie.bitrate = meta["bitrate"]
+    if meta["duration"] and (replace or not movie.length):
+        movie.length = mp4.format_length(meta["duration"])
 
 
 @admin.route("/")
@@ -133,6 +146,7 @@ def tag_add():
 
         db.session.add(tag)
         db.session.commit()
+        cache.bump_catalog_version()
         flash("添加成功", "ok")
 
         oplog = OpLog(
@@ -169,6 +183,9 @@ def tag_del(id=1):
     )
     db.session.delete(tag)
     db.session.commit()
+    cache.bump_catalog_version()
+    # 删除标签会把所属电影的 tag_id 置空，直接全量重新统计
+    facets.reconcile()
     db.session.add(oplog)
     db.session.commit()
 
@@ -192,6 +209,7 @@ def tag_edit(id=1):
         tag.name = data["name"]
         db.session.add(tag)
         db.session.commit()
+        cache.bump_catalog_version()
         flash("修改标签成功", "ok")
 
         oplog = OpLog(
@@ -206,23 +224,118 @@ def tag_edit(id=1):
     return render_template("admin/tag_edit.html", form=form, tag=tag)
 
 
+def upload_submitted(form):
+    # 已经分块上传的字段不再要求表单中带文件
+    for field in uploads.FIELDS:
+        if request.form.get(field + "_upload"):
+            getattr(form, field).validators = []
+
+
+def save_upload(file_field, field):
+    # 优先使用分块上传完成的文件，否则保存表单中的文件，返回保存的文件名；都没有时返回 None
+    upload_id = request.form.get(field + "_upload")
+    if upload_id:
+        return uploads.claim(upload_id, session["admin_id"], field)
+    if hasattr(file_field.data, "filename"):
+        # 视频在计算哈希前把 moov 移到文件开头
+        process = mp4.prepare if field == "url" else None
+        return storage.save(file_field.data.stream, secure_filename(file_field.data.filename), process=process)
+    return None
+
+
+def store_upload(field):
+    # 分块上传完成时按内容保存
+    process = mp4.prepare if field == "url" else None
+    return lambda path, filename: storage.store(path, filename, process=process)
+
+
+def upload_response(data=None, error=None):
+    if error is not None:
+        return Response(json.dumps(dict(code=0, msg=error.msg, offset=error.offset)),
+                        status=error.status, mimetype="application/json")
+    return Response(json.dumps(dict(code=1, **data)), mimetype="application/json")
+
+
+@admin.route("/upload/", methods=["POST"])
+@user_login
+def upload_init():
+    # 建立分块上传：{"filename": 原文件名, "size": 字节数, "field": "url" 或 "logo"}
+    data = request.get_json(force=True, silent=True) or {}
+    try:
+        state = uploads.init(session["admin_id"], data.get("filename") or "", data.get("size") or 0, data.get("field"))
+    except (uploads.UploadError, ValueError) as e:
+        return upload_response(error=e if isinstance(e, uploads.UploadError) else uploads.UploadError("参数错误"))
+    return upload_response(dict(upload_id=state["id"], offset=state["offset"], chunk_size=state["chunk_size"]))
+
+
+@admin.route("/upload/<upload_id>/", methods=["GET", "PUT"])
+@user_login
+def upload_chunk(upload_id):
+    # GET 查询已接收的字节数（断点续传）；PUT ?offset=n 上传一块，请求头 X-Chunk-Sha256 为该块的 SHA-256
+    try:
+        if request.method == "GET":
+            state = uploads.status(upload_id, session["admin_id"])
+            return upload_response(dict(offset=state["offset"], size=state["size"], done=state["done"]))
+        offset = uploads.write_chunk(
+            upload_id,
+            session["admin_id"],
+            request.args.get("offset", -1, type=int),
+            request.stream,
+            request.content_length,
+            request.headers.get("X-Chunk-Sha256")
+        )
+    except uploads.UploadError as e:
+        return upload_response(error=e)
+    return upload_response(dict(offset=offset))
+
+
+@admin.route("/upload/<upload_id>/finalize/", methods=["POST"])
+@user_login
+def upload_finalize(upload_id):
+    # 合并完成；带 movie_id 时直接替换该电影的视频或封面
+    data = request.get_json(force=True, silent=True) or {}
+    try:
+        state = uploads.status(upload_id, session["admin_id"])
+        name = uploads.finalize(upload_id, session["admin_id"], store_upload(state["field"]))
+    except uploads.UploadError as e:
+        return upload_response(error=e)
+    if data.get("movie_id"):
+        movie = Movie.query.get_or_404(int(data["movie_id"]))
+        uploads.claim(upload_id, session["admin_id"], state["field"])
+        if state["field"] == "url":
+            old = movie.url
+            movie.url = name
+            set_video_meta(movie, mp4.read_meta(storage.path(name)), replace=True)
+        else:
+            old = movie.logo
+            movie.logo = name
+            thumbs.generate(name, "poster")
+        db.session.add(movie)
+        db.session.commit()
+        storage.release(old)
+        cache.bump_catalog_version(movie.id)
+    return upload_response(dict(filename=name))
+
+
 @admin.route("/movie/add/", methods=["GET", "POST"])
 @user_login
 def movie_add():
     form = Movieform()
+    upload_submitted(form)
 
     if form.validate_on_submit():
         data = form.data
 
-        file_url = secure_filename(form.url.data.filename)
-        logo_url = secure_filename(form.logo.data.filename)
-        url = change_filename(file_url)
-        logo = change_filename(logo_url)
         if not os.path.exists(app.config["UP_DIR"]):
             os.makedirs(app.config["UP_DIR"])
-
-        form.url.data.save(app.config["UP_DIR"] + url)
-        form.logo.data.save(app.config["UP_DIR"] + logo)
+        url = save_upload(form.url, "url")
+        logo = save_upload(form.logo, "logo")
+        if not url or not logo:
+            flash("上传的文件已失效，请重新上传", "err")
+            return redirect(url_for("admin.movie_add"))
+        # 读取时长、分辨率和码率（保存时已经把 moov 移到文件开头）
+        meta = mp4.read_meta(storage.path(url))
+        thumbs.generate(logo, "poster")
 
         movie = Movie(
             title=data["title"],
@@ -237,8 +350,12 @@ def movie_add():
             release_time=data["release_time"],
             length=data["length"]
         )
+        set_video_meta(movie, meta)
         db.session.add(movie)
         db.session.commit()
+        cache.bump_catalog_version(movie.id)
+        facets.movie_added(movie.tag_id, movie.star)
+        fulltext.index_movie(movie)
         flash("电影添加成功", "ok")
         return redirect(url_for("admin.movie_add"))
     return render_template("admin/movie_add.html", form=form)
@@ -248,7 +365,9 @@ def movie_add():
 @user_login
 def movie_list(page=1):
     form = Movieform()
-    page_data = Movie.query.order_by(
+    page_data = Movie.query.options(
+        joinedload(Movie.tag).load_only("name")
+    ).order_by(
         Movie.add_time.desc()
     ).paginate(page=page, per_page=1)
     return render_template("admin/movie_list.html", form=form, page_data=page_data)
@@ -282,15 +401,20 @@ def movie_edit(id=1):
             return redirect(url_for("admin.movie_edit", id=id))
         if not os.path.exists(app.config["UP_DIR"]):
             os.makedirs(app.config["UP_DIR"])
-        if hasattr(form.url.data, "filename"):
-            file = secure_filename(form.url.data.filename)
-            movie.url = change_filename(file)
-            form.url.data.save(app.config["UP_DIR"] + movie.url)
-
-        if hasattr(form.logo.data, "filename"):
-            file = secure_filename(form.logo.data.filename)
-            movie.logo = change_filename(file)
-            form.logo.data.save(app.config["UP_DIR"] + movie.logo)
+        old_facet = (movie.tag_id, movie.star)
+        released = []
+        meta = None
+        url = save_upload(form.url, "url")
+        if url:
+            released.append(movie.url)
+            movie.url = url
+            meta = mp4.read_meta(storage.path(movie.url))
+
+        logo = save_upload(form.logo, "logo")
+        if logo:
+            released.append(movie.logo)
+            movie.logo = logo
+            thumbs.generate(logo, "poster")
 
         movie.title = data["title"]
         movie.info = data["info"]
@@ -299,8 +423,15 @@ def movie_edit(id=1):
         movie.area = data["area"]
         movie.release_time = data["release_time"]
         movie.length = data["length"]
+        # 表单中填写的片长优先，留空时才使用新视频读取到的时长
+        set_video_meta(movie, meta)
         db.session.add(movie)
         db.session.commit()
+        for name in released:
+            storage.release(name)
+        cache.bump_catalog_version(movie.id)
+        facets.movie_changed(old_facet, (movie.tag_id, movie.star))
+        fulltext.index_movie(movie)
         flash("电影修改成功", "ok")
         return redirect(url_for("admin.movie_edit", id=id))
     return render_template("admin/movie_edit.html", form=form, movie=movie)
@@ -310,8 +441,14 @@ def movie_edit(id=1):
 @user_login
 def movie_del(id=1):
     movie = Movie.query.filter_by(id=id).first_or_404()
+    old_facet = (movie.tag_id, movie.star)
     db.session.delete(movie)
     db.session.commit()
+    storage.release(movie.url)
+    storage.release(movie.logo)
+    cache.bump_catalog_version(id)
+    facets.movie_removed(*old_facet)
+    fulltext.remove_movie(id)
     flash("删除成功", "ok")
     return redirect(url_for("admin.movie_list", page=1))
 
@@ -325,9 +462,8 @@ def preview_add():
         if not os.path.exists(app.config["UP_DIR"]):
             os.makedirs(app.config["UP_DIR"])
 
-        pre_logo = secure_filename(form.logo.data.filename)
-        logo = change_filename(pre_logo)
-        form.logo.data.save(app.config["UP_DIR"] + logo)
+        logo = storage.save(form.logo.data.stream, secure_filename(form.logo.data.filename))
+        thumbs.generate(logo, "preview")
 
         pre = Preview(
             title=data["title"],
@@ -364,14 +500,16 @@ def preview_edit(id=1):
             flash("名称已经存在", "err")
             return redirect(url_for("admin.preview_edit", id=id))
 
+        old = None
         if hasattr(form.logo.data, "filename"):
-            pre_logo = secure_filename(form.logo.data.filename)
-            pre.logo = change_filename(pre_logo)
-            form.logo.data.save(app.config["UP_DIR"] + pre.logo)
+            old = pre.logo
+            pre.logo = storage.save(form.logo.data.stream, secure_filename(form.logo.data.filename))
+            thumbs.generate(pre.logo, "preview")
 
         pre.title = data["title"]
         db.session.add(pre)
         db.session.commit()
+        storage.release(old)
         flash("修改成功", "ok")
     return render_template("admin/preview_edit.html", form=form, preview=pre)
 
@@ -382,6 +520,7 @@ def preview_del(id=1):
     pre = Preview.query.filter_by(id=id).first_or_404()
     db.session.delete(pre)
     db.session.commit()
+    storage.release(pre.logo)
     return redirect(url_for("admin.preview_list", page=1))
 
 
@@ -405,8 +544,13 @@ def user_view(id=1):
 @user_login
 def user_del(id=1):
     user = User.query.get_or_404(id)
+    # 用户的评论随用户一起删除，提交后让这些电影的评论缓存失效
+    movie_ids = [movie_id for movie_id, in db.session.query(Comment.movie_id).filter_by(user_id=user.id).distinct()]
     db.session.delete(user)
     db.session.commit()
+    for movie_id in movie_ids:
+        comments.bump(movie_id)
+    storage.release(user.face, storage.USERS)
     flash("删除成功", "ok")
     return redirect(url_for("admin.user_list", page=1))
 
@@ -421,6 +565,9 @@ def comment_list(page=1):
     ).filter(
         Movie.id == Comment.movie_id,
         User.id == Comment.user_id
+    ).options(
+        contains_eager(Comment.movie).load_only("title"),
+        contains_eager(Comment.user).load_only("name", "face")
     ).order_by(
         Comment.add_time.desc()
     ).paginate(page=page, per_page=2)
@@ -431,12 +578,118 @@ def comment_list(page=1):
 @user_login
 def comment_del(id=1):
     comment = Comment.query.get_or_404(id)
+    movie_id = comment.movie_id
     db.session.delete(comment)
     db.session.commit()
+    comments.bump(movie_id)
     flash("删除成功", "ok")
     return redirect(url_for("admin.comment_list", page=1))
 
 
+@admin.route("/danmaku/list/<int:page>/", methods=["GET"])
+@user_login
+def danmaku_list(page=1):
+    # 归档弹幕列表，可按电影和播放时间段（秒）筛选
+    movie_id = request.args.get("movie_id", type=int)
+    start = request.args.get("start", type=float)
+    end = request.args.get("end", type=float)
+    query = db.session.query(
+        Danmaku, Movie.title
+    ).outerjoin(
+        Movie, Movie.id == Danmaku.movie_id
+    )
+    args = dict()
+    if movie_id:
+        query = query.filter(Danmaku.movie_id == movie_id)
+        args["movie_id"] = movie_id
+    if start is not None:
+        query = query.filter(Danmaku.time >= start)
+        args["start"] = start
+    if end is not None:
+        query = query.filter(Danmaku.time <= end)
+        args["end"] = end
+    page_data = query.order_by(
+        Danmaku.movie_id.asc(), Danmaku.time.asc(), Danmaku.id.asc()
+    ).paginate(page=page, per_page=20)
+    return render_template("admin/danmaku_list.html", page_data=page_data, args=args)
+
+
+@admin.route("/danmaku/export/<int:id>/", methods=["GET"])
+@user_login
+def danmaku_export(id=1):
+    # 以流的方式下载一部电影的全部弹幕，?format=xml|json
+    movie = Movie.query.get_or_404(id)
+    fmt = request.args.get("format", "json")
+    if fmt not in danmaku_io.FORMATS:
+        abort(400)
+    return Response(
+        danmaku_io.export(movie.id, fmt),
+        mimetype="application/xml" if fmt == "xml" else "application/json",
+        headers={"Content-Disposition": "attachment; filename=danmaku-%d.%s" % (movie.id, fmt)}
+    )
+
+
+@admin.route("/sensitive/add/", methods=["GET", "POST"])
+@user_login
+def sensitive_add():
+    form = SensitiveWordForm()
+    if form.validate_on_submit():
+        data = form.data
+        words = set(w.strip() for w in data["words"].splitlines() if w.strip())
+        existing = SensitiveWord.query.filter(SensitiveWord.word.in_(words)).all() if words else []
+        for word in existing:
+            word.policy = data["policy"]
+            db.session.add(word)
+        for w in words - set(word.word for word in existing):
+            db.session.add(SensitiveWord(word=w, policy=data["policy"]))
+        db.session.commit()
+        wordfilter.bump()
+        flash("添加成功", "ok")
+
+        oplog = OpLog(
+            admin_id=session["admin_id"],
+            ip=request.remote_addr,
+            reason="添加了{0}个敏感词".format(len(words))
+        )
+        db.session.add(oplog)
+        db.session.commit()
+        return redirect(url_for("admin.sensitive_add"))
+    return render_template("admin/sensitive_add.html", form=form)
+
+
+@admin.route("/sensitive/list/<int:page>/", methods=["GET"])
+@user_login
+def sensitive_list(page=1):
+    page_data = SensitiveWord.query.order_by(
+        SensitiveWord.add_time.desc()
+    ).paginate(page=page, per_page=20)
+    return render_template("admin/sensitive_list.html", page_data=page_data, policies=dict(wordfilter.POLICIES))
+
+
+@admin.route("/sensitive/del/<int:id>/", methods=["GET"])
+@user_login
+def sensitive_del(id=1):
+    word = SensitiveWord.query.get_or_404(id)
+    oplog = OpLog(
+        admin_id=session["admin_id"],
+        ip=request.remote_addr,
+        reason="删除了敏感词《{0}》".format(word.word)
+    )
+    db.session.delete(word)
+    db.session.add(oplog)
+    db.session.commit()
+    wordfilter.bump()
+    flash("删除成功", "ok")
+    return redirect(url_for("admin.sensitive_list", page=1))
+
+
+@admin.route("/sensitive/flagged/", methods=["GET"])
+@user_login
+def sensitive_flagged():
+    # 命中“标记待审”敏感词的最近评论和弹幕
+    return render_template("admin/sensitive_flagged.html", data=wordfilter.flagged(0, 100))
+
+
 @admin.route("/moviecol/list/<int:page>/", methods=["GET"])
 @user_login
 def moviecol_list(page=1):
@@ -447,6 +700,9 @@ def moviecol_list(page=1):
     ).filter(
         Movie.id == MovieCol.movie_id,
         User.id == MovieCol.user_id
+    ).options(
+        contains_eager(MovieCol.movie).load_only("title"),
+        contains_eager(MovieCol.user).load_only("name")
     ).order_by(
         MovieCol.add_time.desc()
     ).paginate(page=page, per_page=2)
@@ -470,6 +726,8 @@ def oplog_list(page=1):
         Admin
     ).filter(
         Admin.id == OpLog.admin_id
+    ).options(
+        contains_eager(OpLog.admin).load_only("name")
     ).order_by(
         OpLog.add_time.desc()
     ).paginate(page=page, per_page=5)
@@ -483,6 +741,8 @@ def adminloginlog_list(page=1):
         Admin
     ).filter(
         Admin.id == AdminLog.admin_id
+    ).options(
+        contains_eager(AdminLog.admin).load_only("name")
     ).order_by(
         AdminLog.add_time.desc()
     ).paginate(page=page, per_page=5)
@@ -496,6 +756,8 @@ def userloginlog_list(page=1):
         User
     ).filter(
         User.id == UserLog.user_id
+    ).options(
+        contains_eager(UserLog.user).load_only("name")
     ).order_by(
         UserLog.add_time.desc()
     ).paginate(page=page, per_page=5)
@@ -640,6 +902,8 @@ def admin_list(page=1):
         Role
     ).filter(
         Role.id == Admin.role_id
+    ).options(
+        contains_eager(Admin.role).load_only("name")
     ).order_by(
         Admin.add_time.desc()
     ).paginate(page=page, per_page=2)
@@ -0,0 +1,67 @@
+from app import rd
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午4:05"
+
+# 片库版本号，后台增删改电影、标签时递增，所有首页缓存随之失效
+CATALOG_VERSION_KEY = "catalog:version"
+
+# 变更记录：成员为电影 id（"*" 表示需要全量刷新），分值为变更时的版本号
+CATALOG_CHANGES_KEY = "catalog:changes"
+CATALOG_CHANGES_MAX = 10000
+
+# 页面缓存的过期时间（秒），旧版本的缓存靠它自然淘汰
+PAGE_TIMEOUT = 300
+
+
+def catalog_version():
+    return int(rd.get(CATALOG_VERSION_KEY) or 0)
+
+
+def bump_catalog_version(movie_id="*"):
+    """
+    递增片库版本号，并记录本次变更的电影 id，供各进程内的内存索引增量刷新
+    """
+    version = rd.incr(CATALOG_VERSION_KEY)
+    pipe = rd.pipeline()
+    pipe.execute_command("ZADD", CATALOG_CHANGES_KEY, version, movie_id)
+    pipe.zremrangebyrank(CATALOG_CHANGES_KEY, 0, -CATALOG_CHANGES_MAX - 1)
+    pipe.execute()
+    return version
+
+
+def catalog_changes(since):
+    """
+    返回 (当前版本号, 版本 since 之后变更过的电影 id 集合)；
+    变更记录已被截断或包含全量刷新标记时集合为 None
+    """
+    version = catalog_version()
+    if version <= since:
+        return version, set()
+    oldest = rd.zrange(CATALOG_CHANGES_KEY, 0, 0, withscores=True)
+    if not oldest or oldest[0][1] > since + 1:
+        return version, None
+    members = rd.zrangebyscore(CATALOG_CHANGES_KEY, since + 1, "+inf")
+    if b"*" in members:
+        return version, None
+    return version, set(int(v) for v in members)
+
+
+def page_key(name, page, params):
+    """
+    页面缓存键：片库版本 + 页码 + 筛选参数
+    """
+    return "page:{0}:{1}:{2}:{3}".format(
+        name,
+        catalog_version(),
+        page,
+        "&".join("{0}={1}".format(k, params[k]) for k in sorted(params) if params[k] is not None)
+    )
+
+
+def get_page(key):
+    return rd.get(key)
+
+
+def set_page(key, html, timeout=PAGE_TIMEOUT):
+    rd.setex(key, timeout, html)
@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+
+from flask import url_for
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import and_, or_
+
+from app import app, db, rd, thumbs
+from app.models import Comment, User
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午8:05"
+
+# 每部电影的评论版本号，发表评论后递增，旧版本的缓存靠过期时间淘汰
+VERSION_KEY = "comments:version:{0}"
+PAGE_KEY = "comments:{0}:{1}:{2}"
+PAGE_TIMEOUT = 300
+
+PER_PAGE = 10
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+serializer = URLSafeSerializer(app.config["SECRET_KEY"], salt="comment-cursor")
+
+
+def bump(movie_id):
+    rd.incr(VERSION_KEY.format(movie_id))
+
+
+def thread(movie_id, cursor=None, per_page=PER_PAGE):
+    """
+    按 (add_time, id) 倒序游标分页读取评论，返回 JSON 字符串；
+    评论和用户昵称、头像在一条 SQL 中查出，结果按电影缓存
+    """
+    version = int(rd.get(VERSION_KEY.format(movie_id)) or 0)
+    key = PAGE_KEY.format(movie_id, version, cursor or "")
+    data = rd.get(key)
+    if data is not None:
+        return data
+
+    query = db.session.query(
+        Comment.id, Comment.content, Comment.add_time, User.name, User.face
+    ).join(
+        User, User.id == Comment.user_id
+    ).filter(
+        Comment.movie_id == movie_id
+    )
+    position = _decode(movie_id, cursor) if cursor else None
+    if position:
+        add_time, cid = position
+        query = query.filter(or_(
+            Comment.add_time < add_time,
+            and_(Comment.add_time == add_time, Comment.id < cid)
+        ))
+    rows = query.order_by(
+        Comment.add_time.desc(), Comment.id.desc()
+    ).limit(per_page + 1).all()
+
+    items = [
+        dict(
+            id=row.id,
+            content=row.content,
+            add_time=row.add_time.strftime(TIME_FORMAT) if row.add_time else "",
+            name=row.name,
+            face=url_for("static", filename="uploads/users/" + row.face) if row.face else None,
+            face_srcset=thumbs.srcset(row.face, "avatar", "jpg", "users/") if thumbs.enabled(row.face) else None
+        )
+        for row in rows[:per_page]
+    ]
+    last = rows[per_page - 1] if len(rows) > per_page else None
+    data = json.dumps(dict(
+        code=1,
+        data=items,
+        next=serializer.dumps([movie_id, last.add_time.strftime(TIME_FORMAT), last.id]) if last else None
+    ))
+    rd.setex(key, PAGE_TIMEOUT, data)
+    return data
+
+
+def _decode(movie_id, cursor):
+    try:
+        mid, add_time, cid = serializer.loads(cursor)
+    except (BadSignature, ValueError):
+        return None
+    if mid != movie_id:
+        return None
+    return datetime.strptime(add_time, TIME_FORMAT), cid
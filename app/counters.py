@@ -0,0 +1,89 @@
+import threading
+import time
+
+from sqlalchemy import bindparam, func
+from redis.exceptions import ResponseError
+
+from app import app, db, rd
+from app.models import Movie
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午7:30"
+
+# 尚未写入数据库的播放量增量：hash 电影id -> 增量
+PENDING_KEY = "movie:play_pending"
+# 正在写入数据库的一批增量
+FLUSHING_KEY = "movie:play_flushing"
+FLUSH_LOCK_KEY = "movie:play_flush_lock"
+
+# 批量写回的间隔（秒）
+FLUSH_INTERVAL = 10
+
+
+def incr_play(movie_id):
+    """
+    播放量 +1，返回该电影尚未写入数据库的增量
+    """
+    _start_flusher()
+    pipe = rd.pipeline()
+    pipe.hincrby(PENDING_KEY, movie_id, 1)
+    pipe.hget(FLUSHING_KEY, movie_id)
+    pending, flushing = pipe.execute()
+    return int(pending) + int(flushing or 0)
+
+
+def flush():
+    """
+    把累计的增量用一条批量 UPDATE play_num = play_num + n 写回数据库，返回更新的电影数；
+    先 RENAME 取走整批增量，写库期间新的播放继续累计到 PENDING_KEY。
+    写入是“至少一次”的：提交数据库之后、删除 FLUSHING_KEY 之前进程退出时，下次会把这一批再写一遍，
+    播放量会多计这一批（最多 FLUSH_INTERVAL 秒的播放）；播放量只是统计数字，这里不做去重
+    """
+    if not rd.set(FLUSH_LOCK_KEY, 1, nx=True, ex=FLUSH_INTERVAL * 6):
+        return 0
+    try:
+        if not rd.exists(FLUSHING_KEY):
+            try:
+                rd.rename(PENDING_KEY, FLUSHING_KEY)
+            except ResponseError:
+                # 没有待写入的增量
+                return 0
+        data = rd.hgetall(FLUSHING_KEY)
+        params = [dict(mid=int(k), n=int(v)) for k, v in data.items() if int(v)]
+        if params:
+            db.session.execute(
+                Movie.__table__.update().where(
+                    Movie.id == bindparam("mid")
+                ).values(
+                    play_num=func.coalesce(Movie.play_num, 0) + bindparam("n")
+                ),
+                params
+            )
+            db.session.commit()
+        rd.delete(FLUSHING_KEY)
+        return len(params)
+    finally:
+        rd.delete(FLUSH_LOCK_KEY)
+
+
+_flusher = []
+
+
+def _start_flusher():
+    if _flusher:
+        return
+    thread = threading.Thread(target=_run, name="play-counter-flush")
+    thread.daemon = True
+    _flusher.append(thread)
+    thread.start()
+
+
+def _run():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            with app.app_context():
+                flush()
+                db.session.remove()
+        except Exception:
+            app.logger.exception("play counter flush failed")
@@ -0,0 +1,782 @@
+import functools
+import hashlib
+import ipaddress
+import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from app import app, db, rd
+from app.models import Danmaku
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午9:10"
+
+# 每部电影的弹幕按播放时间（秒）存放在有序集合中，分值为弹幕的 time 字段
+ZSET_KEY = "danmaku:{0}"
+# 旧版按发送顺序 lpush 的弹幕列表，读取时自动迁移到有序集合
+LIST_KEY = "movie{0}"
+MIGRATE_LOCK_KEY = "danmaku:{0}:migrating"
+MIGRATE_CHUNK = 1000
+
+# 每部电影的弹幕版本号，写入或淘汰弹幕时在同一个脚本中递增，作为 /tm/ 的 ETag
+VERSION_KEY = "danmaku:{0}:version"
+
+# 拼好的整段响应，按电影和时间段分别缓存，弹幕较多时直接返回它；值为 "版本号:响应体"，版本号不是最新时作废
+BLOB_KEY = "movie{0}:blob:{1}"
+BLOB_TIMEOUT = 30
+HOT_THRESHOLD = 50
+# 进程内缓存的紧凑编码弹幕 -> JSON 的条数。弹幕写入后内容不再变化，
+# 有新弹幕时重新拼接响应只需解码新写入的弹幕
+JSON_CACHE_SIZE = 50000
+
+# 新弹幕的实时推送频道（见 app/live.py）
+LIVE_CHANNEL = "danmaku:{0}:live"
+
+# 保留策略：按写入顺序记录的日志列表（表头最新），淘汰时从表尾取出。元素为 "写入时间戳:分值:引用"，
+# 引用为弹幕 SHA-1 的前 LOG_REF 位，淘汰时在同一分值的弹幕中按引用找到它，日志不再保存弹幕本身；
+# 旧版日志的元素为 "写入时间戳:弹幕"，淘汰时仍然兼容
+LOG_REF = 8
+LOG_KEY = "danmaku:{0}:log"
+# 单部电影的保留策略 hash：max_count 条数上限、max_age 保留秒数，未设置时使用 app.config 中的默认值
+RETENTION_KEY = "danmaku:{0}:retention"
+# 等待写入 MySQL 的淘汰弹幕，元素为 "电影id:写入时间戳:弹幕"
+ARCHIVE_KEY = "danmaku:archive"
+ARCHIVE_LOCK_KEY = "danmaku:archive_lock"
+ARCHIVE_BATCH = 500
+ARCHIVE_INTERVAL = 30
+# 每次写入最多顺带淘汰的条数，避免单条脚本执行过久
+EVICT_PER_WRITE = 100
+
+# 弹幕密度直方图 hash：播放时间桶序号（time // HISTOGRAM_BUCKET）-> 弹幕数，写入和淘汰时增量维护
+HISTOGRAM_KEY = "danmaku:{0}:histogram"
+HISTOGRAM_BUCKET = 5
+# 弹幕播放时间的上限（秒），超出的弹幕不接受，直方图也不统计超出的桶
+MAX_TIME = 24 * 3600
+
+# 发送频率限制的令牌桶，按 ip + 电影计算
+BUCKET_KEY = "danmaku:{0}:bucket:{1}"
+# 批量导入时每个 pipeline 写入的条数
+BULK_BATCH = 1000
+
+# 写入一条弹幕的全部步骤在一个脚本中原子执行：
+#   1. 按 ip + 电影的令牌桶限流（ARGV[9] 为每秒补充的令牌数，0 为不限流），令牌不足时返回 -1
+#   2. 追加弹幕，新增时在写入顺序日志中记下分值和引用（ARGV[13] 为引用的位数；ARGV[2] 为空时跳过，只执行淘汰）
+#   3. 按保留策略淘汰最早写入的弹幕，移入归档队列
+#   4. 按播放时间更新密度直方图（ARGV[12] 为桶的秒数）
+#   5. 有变化时递增版本号，ARGV[11] 不为空时发布到实时推送频道
+# 返回淘汰的条数
+APPEND_SCRIPT = """
+local zset, log, retention, archive, version, bucket = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6]
+local histogram, width = KEYS[8], tonumber(ARGV[12])
+local now = tonumber(ARGV[3])
+local rate = tonumber(ARGV[9])
+if rate > 0 then
+    local burst = tonumber(ARGV[10])
+    local state = redis.call("HMGET", bucket, "tokens", "ts")
+    local tokens = tonumber(state[1] or burst)
+    local last = tonumber(state[2] or now)
+    tokens = math.min(burst, tokens + math.max(now - last, 0) * rate)
+    if tokens < 1 then
+        return -1
+    end
+    redis.call("HMSET", bucket, "tokens", tokens - 1, "ts", now)
+    redis.call("EXPIRE", bucket, math.ceil(burst / rate) + 1)
+end
+if ARGV[2] ~= "" then
+    -- 已存在的弹幕（如重复导入）不再记日志，日志长度与有序集合保持一致
+    if redis.call("ZADD", zset, ARGV[1], ARGV[2]) == 1 then
+        redis.call("HINCRBY", histogram, math.floor(tonumber(ARGV[1]) / width), 1)
+        redis.call("LPUSH", log, ARGV[8] .. ":" .. ARGV[1] .. ":" .. string.sub(redis.sha1hex(ARGV[2]), 1, ARGV[13]))
+    end
+end
+local conf = redis.call("HMGET", retention, "max_count", "max_age")
+local max_count = tonumber(conf[1] or ARGV[5])
+local max_age = tonumber(conf[2] or ARGV[6])
+local limit = tonumber(ARGV[7])
+local evicted = 0
+while evicted < limit do
+    local entry = nil
+    if max_count > 0 and redis.call("LLEN", log) > max_count then
+        entry = redis.call("RPOP", log)
+    elseif max_age > 0 then
+        entry = redis.call("LINDEX", log, -1)
+        if not entry then
+            break
+        end
+        local sep = string.find(entry, ":", 1, true)
+        if tonumber(string.sub(entry, 1, sep - 1)) >= now - max_age then
+            break
+        end
+        redis.call("RPOP", log)
+    else
+        break
+    end
+    local sep = string.find(entry, ":", 1, true)
+    local ts = string.sub(entry, 1, sep - 1)
+    local rest = string.sub(entry, sep + 1)
+    local member = nil
+    local first = string.byte(rest, 1)
+    if first == 123 or first == 1 then
+        -- 旧版日志：JSON 或紧凑编码的弹幕本身
+        member = rest
+    else
+        local mark = string.find(rest, ":", 1, true)
+        local at = string.sub(rest, 1, mark - 1)
+        local ref = string.sub(rest, mark + 1)
+        for _, candidate in ipairs(redis.call("ZRANGEBYSCORE", zset, at, at)) do
+            if string.sub(redis.sha1hex(candidate), 1, #ref) == ref then
+                member = candidate
+                break
+            end
+        end
+    end
+    if member then
+        local score = redis.call("ZSCORE", zset, member)
+        if score and redis.call("ZREM", zset, member) == 1 then
+            redis.call("HINCRBY", histogram, math.floor(tonumber(score) / width), -1)
+            redis.call("LPUSH", archive, ARGV[4] .. ":" .. ts .. ":" .. member)
+        end
+    end
+    evicted = evicted + 1
+end
+if ARGV[2] ~= "" or evicted > 0 then
+    redis.call("INCR", version)
+end
+if ARGV[11] ~= "" then
+    redis.call("PUBLISH", KEYS[7], ARGV[11])
+end
+return evicted
+"""
+_append = rd.register_script(APPEND_SCRIPT)
+
+# 每次最多返回的弹幕条数
+MAX_READ = 3000
+
+# 不指定时间段时的读取：弹幕不超过 ARGV[1] 条时全部返回，否则按播放时间顺序等间隔抽取 ARGV[1] 条，
+# 覆盖整部电影而不是只返回开头的部分
+SAMPLE_SCRIPT = """
+local n = redis.call("ZCARD", KEYS[1])
+local limit = tonumber(ARGV[1])
+if n <= limit then
+    return redis.call("ZRANGE", KEYS[1], 0, -1)
+end
+local out = {}
+for i = 0, limit - 1 do
+    local rank = math.floor(i * n / limit)
+    out[#out + 1] = redis.call("ZRANGE", KEYS[1], rank, rank)[1]
+end
+return out
+"""
+_sample = rd.register_script(SAMPLE_SCRIPT)
+
+# 紧凑编码（第 1 版）：
+#   0x01 | flags | varint 毫秒时间 | 颜色 | 类型 | ip | _id | varint 长度 + 作者 | 内容
+#   颜色为 "#rgb"/"#rrggbb" 时存 3 字节 RGB，否则存字符串；类型 right/top/bottom 存在 flags 的第 3、4 位，
+#   _id 为 14 位时间 + 32 位十六进制时存 6 + 16 字节，ip 存 4/16 字节；player 由 key 中的电影 id 还原。
+#   旧版 JSON 以 "{" 开头，两种格式可以共存
+COMPACT_V1 = 1
+F_COLOR_RGB = 0x01
+F_ID_PACKED = 0x02
+F_IP_PACKED = 0x04
+F_COLOR_SHORT = 0x20
+TYPES = ("right", "top", "bottom")
+TYPE_SHIFT = 3
+TYPE_OTHER = 3
+
+
+def version(movie_id):
+    return int(rd.get(VERSION_KEY.format(movie_id)) or 0)
+
+
+def etag(movie_id):
+    return str(version(movie_id))
+
+
+def read(movie_id, start=None, end=None):
+    """
+    返回 (版本号, /tm/ GET 的响应体)；指定 start/end（秒）时只返回该播放时间段内的弹幕，
+    不指定时返回整部电影的弹幕，超过 MAX_READ 条时在整个时间轴上等间隔抽取。
+    版本号和弹幕在同一个事务中读取，旧版 JSON 弹幕原样拼接，紧凑编码的弹幕按条缓存解码结果，整段响应按时间段缓存
+    """
+    blob_key = BLOB_KEY.format(movie_id, "" if start is None and end is None else "%r-%r" % (start, end))
+    pipe = rd.pipeline()
+    pipe.get(VERSION_KEY.format(movie_id))
+    pipe.get(blob_key)
+    current, blob = pipe.execute()
+    current = int(current or 0)
+    if blob is not None:
+        cached, body = blob.split(b":", 1)
+        if cached.isdigit() and int(cached) == current:
+            return current, body
+
+    pipe = rd.pipeline()
+    pipe.get(VERSION_KEY.format(movie_id))
+    pipe.exists(LIST_KEY.format(movie_id))
+    _range(pipe, movie_id, start, end)
+    current, legacy, msgs = pipe.execute()
+    if legacy:
+        migrate(movie_id)
+        pipe = rd.pipeline()
+        pipe.get(VERSION_KEY.format(movie_id))
+        _range(pipe, movie_id, start, end)
+        current, msgs = pipe.execute()
+    current = int(current or 0)
+
+    body = b'{"code": 1, "danmaku": [' + b", ".join(to_json(v, movie_id) for v in msgs) + b"]}"
+    if len(msgs) >= HOT_THRESHOLD:
+        rd.setex(blob_key, BLOB_TIMEOUT, b"%d:%s" % (current, body))
+    return current, body
+
+
+def _range(client, movie_id, start, end):
+    if start is None and end is None:
+        return _sample(keys=[ZSET_KEY.format(movie_id)], args=[MAX_READ], client=client)
+    return client.zrangebyscore(
+        ZSET_KEY.format(movie_id),
+        "-inf" if start is None else start,
+        "+inf" if end is None else end,
+        start=0, num=MAX_READ
+    )
+
+
+def play_time(value):
+    """
+    校验弹幕的播放时间（秒）：不是有限的数值或超过 MAX_TIME 时抛出 ValueError，负数按 0 处理
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("invalid danmaku time %r" % (value,))
+    if math.isnan(value) or math.isinf(value) or value > MAX_TIME:
+        raise ValueError("invalid danmaku time %r" % (value,))
+    value = max(value, 0.0)
+    return int(value) if value.is_integer() else value
+
+
+def push(data, ip):
+    """
+    保存一条弹幕并推送给正在观看的用户，返回保存的弹幕；发送太频繁时返回 None，
+    播放时间不合法时抛出 ValueError
+    """
+    msg = {
+        "__v": 0,
+        "author": data["author"],
+        "time": play_time(data["time"]),
+        "text": data["text"],
+        "color": data["color"],
+        "type": data['type'],
+        "ip": ip,
+        "_id": datetime.now().strftime("%Y%m%d%H%M%S") + uuid.uuid4().hex,
+        "player": [
+            data["player"]
+        ]
+    }
+    _start_archiver()
+    evicted = _run_append(
+        rd, data["player"], msg["time"], encode(msg),
+        ip=ip, payload=json.dumps(msg)
+    )
+    if evicted < 0:
+        return None
+    return msg
+
+
+def bulk_push(movie_id, msgs, batch=BULK_BATCH):
+    """
+    批量写入弹幕（导入、回放弹幕文件），每 batch 条用一个 pipeline 提交；
+    不限流、不推送，同样执行保留策略。msgs 为弹幕 dict 的可迭代对象，播放时间不合法的弹幕跳过；返回写入的条数
+    """
+    num = 0
+    pipe = rd.pipeline(transaction=False)
+    for msg in msgs:
+        try:
+            msg = dict(msg, player=[str(movie_id)], time=play_time(msg.get("time")))
+        except ValueError:
+            continue
+        if not msg.get("_id"):
+            msg["_id"] = datetime.now().strftime("%Y%m%d%H%M%S") + uuid.uuid4().hex
+        _run_append(
+            pipe, movie_id, msg["time"], encode(msg),
+            ts=timestamp(msg["_id"]) or None
+        )
+        num += 1
+        if num % batch == 0:
+            pipe.execute()
+    pipe.execute()
+    return num
+
+
+def _run_append(client, movie_id, score=0, member=b"", limit=EVICT_PER_WRITE, ts=None, ip=None, payload=""):
+    now = time.time()
+    return _append(
+        keys=[
+            ZSET_KEY.format(movie_id),
+            LOG_KEY.format(movie_id),
+            RETENTION_KEY.format(movie_id),
+            ARCHIVE_KEY,
+            VERSION_KEY.format(movie_id),
+            BUCKET_KEY.format(movie_id, ip or ""),
+            LIVE_CHANNEL.format(movie_id),
+            HISTOGRAM_KEY.format(movie_id)
+        ],
+        args=[
+            score, member, now, movie_id,
+            app.config["DANMAKU_MAX_COUNT"], app.config["DANMAKU_MAX_AGE"], limit,
+            int(ts or now),
+            app.config["DANMAKU_RATE"] if ip else 0, app.config["DANMAKU_BURST"],
+            payload, HISTOGRAM_BUCKET, LOG_REF
+        ],
+        client=client
+    )
+
+
+def set_retention(movie_id, max_count=None, max_age=None):
+    """
+    设置单部电影的保留策略（条数上限、保留秒数，0 为不限），None 表示恢复默认值
+    """
+    key = RETENTION_KEY.format(movie_id)
+    pipe = rd.pipeline()
+    for field, value in (("max_count", max_count), ("max_age", max_age)):
+        if value is None:
+            pipe.hdel(key, field)
+        else:
+            pipe.hset(key, field, int(value))
+    pipe.execute()
+
+
+def trim(movie_id, batch=1000):
+    """
+    立即按保留策略淘汰一部电影的弹幕（没有新弹幕写入的电影也会过期），返回淘汰的条数
+    """
+    num = 0
+    while True:
+        evicted = _run_append(rd, movie_id, limit=batch)
+        num += evicted
+        if evicted < batch:
+            return num
+
+
+def histogram(movie_id, width=HISTOGRAM_BUCKET):
+    """
+    返回每 width 秒播放时间内的弹幕数列表（下标为桶序号），width 按 HISTOGRAM_BUCKET 的整数倍取整
+    """
+    factor = max(int(width) // HISTOGRAM_BUCKET, 1)
+    last = MAX_TIME // HISTOGRAM_BUCKET
+    counts = []
+    for field, value in rd.hgetall(HISTOGRAM_KEY.format(movie_id)).items():
+        value = int(value)
+        # 负数和超出 MAX_TIME 的桶只可能来自校验播放时间之前写入的弹幕
+        if value <= 0 or not 0 <= int(field) <= last:
+            continue
+        index = int(field) // factor
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += value
+    return counts
+
+
+def rebuild_histogram(movie_id, batch=MIGRATE_CHUNK):
+    """
+    按有序集合中的现有弹幕重建密度直方图，返回统计的弹幕数
+    """
+    counts = {}
+    cursor = 0
+    while True:
+        cursor, items = rd.zscan(ZSET_KEY.format(movie_id), cursor, count=batch)
+        for member, score in items:
+            if not 0 <= score <= MAX_TIME:
+                continue
+            index = int(score // HISTOGRAM_BUCKET)
+            counts[index] = counts.get(index, 0) + 1
+        if not cursor:
+            break
+    key = HISTOGRAM_KEY.format(movie_id)
+    if not counts:
+        rd.delete(key)
+        return 0
+    tmp_key = key + ":tmp"
+    pipe = rd.pipeline()
+    pipe.delete(tmp_key)
+    pipe.hmset(tmp_key, counts)
+    pipe.rename(tmp_key, key)
+    pipe.execute()
+    return sum(counts.values())
+
+
+def timestamp(_id):
+    try:
+        return int(time.mktime(datetime.strptime(_id[:14], "%Y%m%d%H%M%S").timetuple()))
+    except (TypeError, ValueError):
+        return 0
+
+
+def log_ref(score, member):
+    # 日志元素中写入时间戳之后的部分："分值:引用"，与 APPEND_SCRIPT 中的格式一致
+    return ("%r:%s" % (float(score), hashlib.sha1(member).hexdigest()[:LOG_REF])).encode()
+
+
+def rebuild_log(movie_id, batch=MIGRATE_CHUNK):
+    """
+    按弹幕的发送时间重建写入顺序日志（迁移、转换编码后、保留策略上线前的旧数据或旧版日志格式）。
+    重建期间新写入的弹幕不会出现在新日志中，建议在低峰期执行
+    """
+    key = ZSET_KEY.format(movie_id)
+    log_key = LOG_KEY.format(movie_id)
+    # 先按发送时间写入临时有序集合排序，再分批写回日志，内存中最多只有 batch 条
+    order_key = log_key + ":order"
+    tmp_key = log_key + ":tmp"
+    rd.delete(order_key, tmp_key)
+    cursor = 0
+    while True:
+        cursor, items = rd.zscan(key, cursor, count=batch)
+        args = []
+        for member, score in items:
+            ts = timestamp(decode(member, movie_id)["_id"])
+            args.extend([ts, b"%d:%s" % (ts, log_ref(score, member))])
+        if args:
+            rd.execute_command("ZADD", order_key, *args)
+        if not cursor:
+            break
+    num = rd.zcard(order_key)
+    for i in range(0, num, batch):
+        rd.rpush(tmp_key, *rd.zrevrange(order_key, i, i + batch - 1))
+    if num:
+        rd.rename(tmp_key, log_key)
+    else:
+        rd.delete(log_key)
+    rd.delete(order_key)
+    return num
+
+
+def archive(batch=ARCHIVE_BATCH):
+    """
+    把淘汰的弹幕分批写入 MySQL 的 danmaku 表，返回写入的条数；
+    按 uid 去重，写库失败时这一批留在队列中下次重试
+    """
+    if not rd.set(ARCHIVE_LOCK_KEY, 1, nx=True, ex=ARCHIVE_INTERVAL * 10):
+        return 0
+    try:
+        num = 0
+        while True:
+            entries = rd.lrange(ARCHIVE_KEY, -batch, -1)
+            if not entries:
+                return num
+            rows = []
+            for entry in entries:
+                movie_id, ts, member = entry.split(b":", 2)
+                msg = decode(member, movie_id.decode())
+                rows.append(dict(
+                    uid=msg["_id"],
+                    movie_id=int(movie_id),
+                    author=msg["author"],
+                    time=float(msg["time"]),
+                    text=msg["text"],
+                    color=msg["color"],
+                    type=msg["type"],
+                    ip=msg["ip"],
+                    add_time=datetime.fromtimestamp(timestamp(msg["_id"]) or int(ts)),
+                    archive_time=datetime.now()
+                ))
+            db.session.execute(Danmaku.__table__.insert().prefix_with("IGNORE"), rows)
+            db.session.commit()
+            rd.ltrim(ARCHIVE_KEY, 0, -len(entries) - 1)
+            num += len(entries)
+    finally:
+        rd.delete(ARCHIVE_LOCK_KEY)
+
+
+_archiver = []
+
+
+def _start_archiver():
+    if _archiver:
+        return
+    thread = threading.Thread(target=_run_archiver, name="danmaku-archive")
+    thread.daemon = True
+    _archiver.append(thread)
+    thread.start()
+
+
+def _run_archiver():
+    while True:
+        time.sleep(ARCHIVE_INTERVAL)
+        try:
+            with app.app_context():
+                archive()
+                db.session.remove()
+        except Exception:
+            app.logger.exception("danmaku archive failed")
+
+
+def migrate(movie_id):
+    """
+    把旧版列表中的弹幕按 time 字段分批写入有序集合，完成后删除列表；返回迁移的条数，time 不合法的弹幕丢弃
+    """
+    if not rd.set(MIGRATE_LOCK_KEY.format(movie_id), 1, nx=True, ex=300):
+        return 0
+    try:
+        list_key = LIST_KEY.format(movie_id)
+        num = 0
+        while True:
+            # 从表尾（最早的弹幕）开始逐批搬运，搬完一批删一批，中断后可以继续
+            msgs = rd.lrange(list_key, -MIGRATE_CHUNK, -1)
+            if not msgs:
+                break
+            args = []
+            for msg in msgs:
+                # 旧版原样保存客户端发送的 time，缺失或不合法的弹幕跳过，不影响其余弹幕的迁移
+                try:
+                    args.extend([play_time(json.loads(msg.decode("utf8"))["time"]), msg])
+                except (ValueError, KeyError, TypeError):
+                    app.logger.warning("skip invalid legacy danmaku of movie %s: %r", movie_id, msg[:200])
+            pipe = rd.pipeline()
+            if args:
+                pipe.execute_command("ZADD", ZSET_KEY.format(movie_id), *args)
+            pipe.ltrim(list_key, 0, -len(msgs) - 1)
+            pipe.execute()
+            num += len(args) // 2
+        rd.incr(VERSION_KEY.format(movie_id))
+        rebuild_log(movie_id)
+        rebuild_histogram(movie_id)
+        return num
+    finally:
+        rd.delete(MIGRATE_LOCK_KEY.format(movie_id))
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _text(value):
+    # 导入的数据中字段可能是数字，统一转换为字符串；只有 None 视为空
+    return u"" if value is None else u"%s" % value
+
+
+def _string(value):
+    value = _text(value).encode("utf8")
+    return _varint(len(value)) + value
+
+
+def _read_string(data, pos):
+    size, pos = _read_varint(data, pos)
+    return data[pos:pos + size].decode("utf8"), pos + size
+
+
+def encode(msg):
+    """
+    把弹幕编码为紧凑的二进制格式
+    """
+    flags = 0
+    parts = [_varint(max(int(round(float(msg["time"]) * 1000)), 0))]
+
+    color = msg.get("color")
+    if isinstance(color, int) and not isinstance(color, bool):
+        # 数字颜色（如 16777215）按 RGB 处理
+        color = "#%06x" % (color & 0xffffff)
+    color = _text(color)
+    rgb = color[1:] if color.startswith("#") else ""
+    if len(rgb) == 3:
+        flags |= F_COLOR_SHORT
+        rgb = "".join(c * 2 for c in rgb)
+    try:
+        value = int(rgb, 16) if len(rgb) == 6 else None
+    except ValueError:
+        value = None
+    if value is None:
+        flags &= ~F_COLOR_SHORT
+        parts.append(_string(color))
+    else:
+        flags |= F_COLOR_RGB
+        parts.append(struct.pack(">I", value)[1:])
+
+    type_ = msg.get("type")
+    if isinstance(type_, int) and not isinstance(type_, bool) and 0 <= type_ < len(TYPES):
+        # DPlayer 的数字类型 0/1/2
+        type_ = TYPES[type_]
+    if type_ in TYPES:
+        flags |= TYPES.index(type_) << TYPE_SHIFT
+    else:
+        flags |= TYPE_OTHER << TYPE_SHIFT
+        parts.append(_string(type_))
+
+    try:
+        packed = ipaddress.ip_address(u"%s" % msg.get("ip")).packed
+        parts.append(struct.pack("B", len(packed)) + packed)
+        flags |= F_IP_PACKED
+    except ValueError:
+        parts.append(_string(msg.get("ip")))
+
+    _id = _text(msg.get("_id"))
+    if len(_id) == 46 and _id[:14].isdigit():
+        try:
+            parts.append(struct.pack(">Q", int(_id[:14]))[2:] + bytes(bytearray.fromhex(_id[14:])))
+            flags |= F_ID_PACKED
+        except ValueError:
+            parts.append(_string(_id))
+    else:
+        parts.append(_string(_id))
+
+    parts.append(_string(msg.get("author")))
+    parts.append(_text(msg.get("text")).encode("utf8"))
+    return struct.pack("BB", COMPACT_V1, flags) + b"".join(parts)
+
+
+def decode(data, movie_id):
+    """
+    解码一条弹幕，兼容旧版 JSON 格式
+    """
+    if data[:1] == b"{":
+        return json.loads(data.decode("utf8"))
+    data = bytearray(data)
+    if data[0] != COMPACT_V1:
+        raise ValueError("unknown danmaku encoding %d" % data[0])
+    flags = data[1]
+    time_ms, pos = _read_varint(data, 2)
+
+    if flags & F_COLOR_RGB:
+        color = "#%06x" % struct.unpack(">I", b"\x00" + bytes(data[pos:pos + 3]))[0]
+        if flags & F_COLOR_SHORT:
+            color = "#" + color[1::2]
+        pos += 3
+    else:
+        color, pos = _read_string(data, pos)
+
+    code = (flags >> TYPE_SHIFT) & 0x03
+    if code == TYPE_OTHER:
+        type_, pos = _read_string(data, pos)
+    else:
+        type_ = TYPES[code]
+
+    if flags & F_IP_PACKED:
+        size = data[pos]
+        ip = str(ipaddress.ip_address(bytes(data[pos + 1:pos + 1 + size])))
+        pos += 1 + size
+    else:
+        ip, pos = _read_string(data, pos)
+
+    if flags & F_ID_PACKED:
+        _id = "%014d" % struct.unpack(">Q", b"\x00\x00" + bytes(data[pos:pos + 6]))[0]
+        _id += "".join("%02x" % b for b in data[pos + 6:pos + 22])
+        pos += 22
+    else:
+        _id, pos = _read_string(data, pos)
+
+    author, pos = _read_string(data, pos)
+    text = data[pos:].decode("utf8")
+    time_ = time_ms / 1000.0
+    return {
+        "__v": 0,
+        "author": author,
+        "time": int(time_) if time_ms % 1000 == 0 else time_,
+        "text": text,
+        "color": color,
+        "type": type_,
+        "ip": ip,
+        "_id": _id,
+        "player": [
+            str(movie_id)
+        ]
+    }
+
+
+def to_json(data, movie_id):
+    """
+    存储格式 -> JSON 字节串，旧版 JSON 原样返回
+    """
+    if data[:1] == b"{":
+        return data
+    return _compact_json(data, str(movie_id))
+
+
+@functools.lru_cache(maxsize=JSON_CACHE_SIZE)
+def _compact_json(data, movie_id):
+    return json.dumps(decode(data, movie_id)).encode("utf8")
+
+
+def convert(movie_id, batch=MIGRATE_CHUNK):
+    """
+    把一部电影中的 JSON 弹幕转换为紧凑编码，返回转换的条数
+    """
+    key = ZSET_KEY.format(movie_id)
+    num = 0
+    cursor = 0
+    while True:
+        cursor, items = rd.zscan(key, cursor, count=batch)
+        legacy = [(member, score) for member, score in items if member[:1] == b"{"]
+        if legacy:
+            pipe = rd.pipeline()
+            for member, score in legacy:
+                pipe.zrem(key, member)
+                pipe.execute_command("ZADD", key, score, encode(json.loads(member.decode("utf8"))))
+            pipe.execute()
+            num += len(legacy)
+        if not cursor:
+            break
+    rd.incr(VERSION_KEY.format(movie_id))
+    if num:
+        rebuild_log(movie_id)
+    return num
+
+
+def memory_report(num=100000, movie_id="memory-report"):
+    """
+    生成 num 条模拟弹幕，分别用 JSON 和紧凑编码写入临时 key，比较 Redis 占用的内存
+    """
+    words = [u"前方高能", u"哈哈哈哈", u"awsl", u"这里好燃", u"2333", u"名场面", u"泪目", u"打卡"]
+    colors = ["#fff", "#e54256", "#ffe133", "#64DD17", "#39ccff", "#D500F9"]
+    start = datetime(2018, 3, 29)
+    keys = dict(json=ZSET_KEY.format(movie_id + ":json"), compact=ZSET_KEY.format(movie_id + ":compact"))
+    rd.delete(*keys.values())
+    raw = dict(json=0, compact=0)
+    pipe = rd.pipeline()
+    for i in range(num):
+        msg = {
+            "__v": 0,
+            "author": u"user%d" % random.randint(1, 5000),
+            "time": round(random.uniform(0, 7200), 3),
+            "text": random.choice(words) * random.randint(1, 3),
+            "color": random.choice(colors),
+            "type": random.choice(TYPES),
+            "ip": "192.168.%d.%d" % (random.randint(0, 255), random.randint(1, 254)),
+            "_id": (start + timedelta(seconds=i)).strftime("%Y%m%d%H%M%S") + uuid.uuid4().hex,
+            "player": [movie_id]
+        }
+        for name, value in (("json", json.dumps(msg).encode("utf8")), ("compact", encode(msg))):
+            raw[name] += len(value)
+            pipe.execute_command("ZADD", keys[name], msg["time"], value)
+        if i % 1000 == 999:
+            pipe.execute()
+    pipe.execute()
+    report = {}
+    for name, key in keys.items():
+        try:
+            usage = rd.execute_command("MEMORY", "USAGE", key, "SAMPLES", 0)
+        except Exception:
+            usage = None
+        report[name] = dict(bytes=raw[name], memory=usage)
+    rd.delete(*keys.values())
+    return report
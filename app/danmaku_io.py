@@ -0,0 +1,230 @@
+import codecs
+import json
+import re
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+from app import rd, danmaku
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午11:20"
+
+# 导入导出均为流式处理：导出按分值（播放时间）分批读取，导入用生成器逐条解析后交给 danmaku.bulk_push，
+# 内存占用与弹幕总数无关
+EXPORT_BATCH = 1000
+READ_SIZE = 64 * 1024
+
+# 常见 XML 弹幕格式 <d p="时间,模式,字号,十进制颜色,发送时间戳,弹幕池,用户,编号">内容</d> 中的模式
+XML_MODES = {"right": 1, "bottom": 4, "top": 5}
+XML_TYPES = {1: "right", 2: "right", 3: "right", 4: "bottom", 5: "top", 6: "right"}
+# DPlayer 新版 JSON 格式 [时间, 类型, 十进制颜色, 作者, 内容] 中的类型
+JSON_TYPES = ("right", "top", "bottom")
+
+FORMATS = ("json", "xml")
+
+SEPARATOR = re.compile(r"[\s,]*")
+
+
+def iter_messages(movie_id, batch=EXPORT_BATCH):
+    """
+    按播放时间顺序逐条返回一部电影的弹幕。按分值而不是排名翻页，导出期间写入或淘汰弹幕不会造成遗漏或重复
+    """
+    if rd.exists(danmaku.LIST_KEY.format(movie_id)):
+        danmaku.migrate(movie_id)
+    key = danmaku.ZSET_KEY.format(movie_id)
+    last = None
+    while True:
+        if last is None:
+            items = rd.zrangebyscore(key, "-inf", "+inf", start=0, num=batch, withscores=True)
+        else:
+            score, member = last
+            # 与上一批最后一条分值相同的弹幕按成员顺序接着取，之后从更大的分值继续
+            ties = [(m, score) for m in rd.zrangebyscore(key, score, score) if m > member]
+            items = ties + rd.zrangebyscore(key, "(%r" % score, "+inf", start=0, num=batch, withscores=True)
+        if not items:
+            break
+        for member, score in items:
+            yield danmaku.decode(member, movie_id)
+        last = (items[-1][1], items[-1][0])
+
+
+def export_json(movie_id):
+    """
+    导出为 /tm/ 接口相同的 JSON 格式，生成字符串片段
+    """
+    yield '{"code": 1, "danmaku": ['
+    first = True
+    for msg in iter_messages(movie_id):
+        yield ("" if first else ",\n") + json.dumps(msg)
+        first = False
+    yield "]}\n"
+
+
+def export_xml(movie_id):
+    """
+    导出为常见的 XML 弹幕格式，生成字符串片段
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<i>\n'
+    yield "<chatid>%s</chatid>\n" % escape(str(movie_id))
+    for msg in iter_messages(movie_id):
+        p = ",".join(str(v) for v in (
+            msg["time"],
+            XML_MODES.get(msg["type"], 1),
+            25,
+            _color_to_int(msg["color"]),
+            danmaku.timestamp(msg["_id"]),
+            0,
+            (msg["author"] or "").replace(",", " "),
+            msg["_id"]
+        ))
+        yield "<d p=%s>%s</d>\n" % (quoteattr(p), escape(msg["text"] or ""))
+    yield "</i>\n"
+
+
+def export(movie_id, fmt="json"):
+    return export_xml(movie_id) if fmt == "xml" else export_json(movie_id)
+
+
+def parse_xml(fileobj):
+    """
+    逐条解析 XML 弹幕，根节点下的子节点处理完后随即从根节点移除，内存占用与弹幕条数无关
+    """
+    root = None
+    depth = 0
+    for event, elem in ElementTree.iterparse(fileobj, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        p = (elem.get("p") or "").split(",") if elem.tag == "d" else []
+        if len(p) >= 4:
+            try:
+                mode = int(p[1])
+            except ValueError:
+                mode = 1
+            yield dict(
+                __v=0,
+                time=_number(p[0]),
+                type=XML_TYPES.get(mode, "right"),
+                color=_int_to_color(p[3]),
+                author=p[6] if len(p) > 6 else "",
+                text=elem.text or "",
+                ip="",
+                _id=p[7] if len(p) > 7 and len(p[7]) == 46 else None
+            )
+        if depth == 1:
+            root.clear()
+
+
+def parse_json(fileobj, read_size=READ_SIZE):
+    """
+    逐条解析 JSON 弹幕：支持 /tm/ 格式 {"danmaku": [{...}]}、DPlayer 新版 {"data": [[...]]} 和直接的数组，
+    按块读取文件，只缓存尚未解析完的一个元素
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf8")()
+    buf = ""
+    started = False
+    eof = False
+    while True:
+        if not eof:
+            chunk = fileobj.read(read_size)
+            if isinstance(chunk, bytes):
+                chunk = utf8.decode(chunk, final=not chunk)
+            eof = not chunk
+            buf += chunk
+        if not started:
+            pos = buf.find("[")
+            if pos < 0:
+                if eof:
+                    return
+                continue
+            buf = buf[pos + 1:]
+            started = True
+        pos = 0
+        while True:
+            pos = SEPARATOR.match(buf, pos).end()
+            if buf.startswith("]", pos):
+                return
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # 元素不完整，继续读取
+                break
+            yield _from_json(item)
+        buf = buf[pos:]
+        if eof:
+            return
+
+
+def _from_json(item):
+    if isinstance(item, list):
+        time_, type_, color, author, text = (list(item) + [None] * 5)[:5]
+        return dict(
+            __v=0,
+            time=_number(time_),
+            type=JSON_TYPES[type_] if type_ in (0, 1, 2) else "right",
+            color=_int_to_color(color),
+            author=author or "",
+            text=text or "",
+            ip="",
+            _id=None
+        )
+    type_, color = item.get("type"), item.get("color")
+    return dict(
+        __v=0,
+        time=_number(item.get("time")),
+        type=JSON_TYPES[type_] if type_ in (0, 1, 2) else _field(type_) or "right",
+        color=_int_to_color(color) if isinstance(color, (int, float)) else _field(color) or "#fff",
+        author=_field(item.get("author")),
+        text=_field(item.get("text")),
+        ip=_field(item.get("ip")),
+        _id=_field(item.get("_id")) or None
+    )
+
+
+def _field(value):
+    # 与数组格式一致，字段统一为字符串
+    return "" if value is None else "%s" % value
+
+
+def parse(fileobj, fmt="json"):
+    return parse_xml(fileobj) if fmt == "xml" else parse_json(fileobj)
+
+
+def import_file(movie_id, fileobj, fmt="json"):
+    """
+    从文件导入弹幕，返回导入的条数
+    """
+    return danmaku.bulk_push(movie_id, parse(fileobj, fmt))
+
+
+def guess_format(filename):
+    return "xml" if filename.lower().endswith(".xml") else "json"
+
+
+def _number(value):
+    # 与发送弹幕相同的校验，不合法或超过 danmaku.MAX_TIME 的播放时间按 0 处理
+    try:
+        return danmaku.play_time(value)
+    except ValueError:
+        return 0
+
+
+def _color_to_int(color):
+    rgb = (color or "")[1:] if (color or "").startswith("#") else ""
+    if len(rgb) == 3:
+        rgb = "".join(c * 2 for c in rgb)
+    try:
+        return int(rgb, 16) if len(rgb) == 6 else 16777215
+    except ValueError:
+        return 16777215
+
+
+def _int_to_color(value):
+    try:
+        return "#%06x" % (int(value) & 0xffffff)
+    except (TypeError, ValueError):
+        return "#fff"
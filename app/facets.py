@@ -0,0 +1,116 @@
+from sqlalchemy import func
+
+from app import db, rd
+from app.models import Movie
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午5:10"
+
+# 首页筛选栏计数：hash 字段为 "标签id:星级"，值为电影数量
+FACETS_KEY = "movie:facets"
+
+
+def _field(tag_id, star):
+    return "{0}:{1}".format(int(tag_id or 0), int(star or 0))
+
+
+# 计数存在时才增量修改：key 被清空或淘汰后直接 HINCRBY 会留下只有部分字段的 hash，
+# 读取时又不会重新统计。返回 0 表示 key 不存在，调用方改为全量统计
+INCR_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call("HINCRBY", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+_incr = rd.register_script(INCR_SCRIPT)
+
+
+def _apply(*changes):
+    # changes 为 (字段, 增量)
+    args = []
+    for field, delta in changes:
+        args.extend([field, delta])
+    if not _incr(keys=[FACETS_KEY], args=args):
+        reconcile()
+
+
+def movie_added(tag_id, star):
+    _apply((_field(tag_id, star), 1))
+
+
+def movie_removed(tag_id, star):
+    _apply((_field(tag_id, star), -1))
+
+
+def movie_changed(old, new):
+    """
+    old/new 为修改前后的 (标签id, 星级)
+    """
+    if _field(*old) == _field(*new):
+        return
+    _apply((_field(*old), -1), (_field(*new), 1))
+
+
+def reconcile():
+    """
+    全量重新统计，先写临时 key 再 RENAME，读者不会看到半成品
+    """
+    rows = db.session.query(
+        Movie.tag_id, Movie.star, func.count(Movie.id)
+    ).group_by(Movie.tag_id, Movie.star).all()
+    data = dict((_field(tag_id, star), num) for tag_id, star, num in rows)
+    if not data:
+        rd.delete(FACETS_KEY)
+        return data
+    tmp = FACETS_KEY + ":tmp"
+    pipe = rd.pipeline()
+    pipe.delete(tmp)
+    pipe.hmset(tmp, data)
+    pipe.rename(tmp, FACETS_KEY)
+    pipe.execute()
+    return data
+
+
+def counts():
+    """
+    返回 {(标签id, 星级): 数量}，计数不存在时先全量统计一次
+    """
+    data = rd.hgetall(FACETS_KEY)
+    if not data:
+        data = reconcile()
+    result = {}
+    for field, num in data.items():
+        if isinstance(field, bytes):
+            field = field.decode()
+        tag_id, star = field.split(":")
+        result[(int(tag_id), int(star))] = int(num)
+    return result
+
+
+def total(tid=0, star=0, data=None):
+    """
+    指定标签、星级（0 表示不限）下的电影数量
+    """
+    data = counts() if data is None else data
+    return sum(
+        num for (tag_id, s), num in data.items()
+        if (not tid or tag_id == tid) and (not star or s == star)
+    )
+
+
+def filter_counts(p):
+    """
+    首页筛选栏计数：每个标签在当前星级下的数量，每个星级在当前标签下的数量
+    """
+    data = counts()
+    tid, star = int(p["tid"]), int(p["star"])
+    tags, stars = {}, {}
+    for (tag_id, s), num in data.items():
+        if not star or s == star:
+            tags[tag_id] = tags.get(tag_id, 0) + num
+        if not tid or tag_id == tid:
+            stars[s] = stars.get(s, 0) + num
+    return dict(tags=tags, stars=stars)
@@ -0,0 +1,196 @@
+import math
+import re
+import threading
+from collections import Counter
+
+from app import app, db, rd
+from app.models import Movie
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午5:45"
+
+# 倒排索引的 Redis key：
+#   search:t:<词>    hash 电影id -> 加权词频
+#   search:d:<id>    hash 词 -> 加权词频（删除、重建单部电影时使用）
+#   search:len       hash 电影id -> 文档长度
+#   search:stats     hash len -> 全部文档长度之和
+#   search:ready     全量建立完成的标记；不存在时（首次部署、Redis 被清空）在后台线程中自动建立，
+#                    建立期间搜索按标题子串查询，也可以手动执行 python manage.py rebuild_search
+TERM_KEY = "search:t:"
+DOC_KEY = "search:d:"
+LEN_KEY = "search:len"
+STATS_KEY = "search:stats"
+READY_KEY = "search:ready"
+BUILD_LOCK_KEY = "search:building"
+BUILD_TIMEOUT = 600
+
+# 标题中的词比简介中的词权重更高
+TITLE_WEIGHT = 3
+INFO_WEIGHT = 1
+
+# BM25 参数
+K1 = 1.2
+B = 0.75
+
+# 中日韩文字按单字 + 二元组切分，字母数字按单词切分
+TOKEN_RE = re.compile(u"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+)|([0-9a-z]+)")
+
+
+def tokenize(text, query=False):
+    """
+    切词：中文连续片段取相邻二元组（建索引时另加单字），查询时单字片段按单字查
+    """
+    tokens = []
+    for cjk, word in TOKEN_RE.findall((text or "").lower()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+            if not query:
+                tokens.extend(cjk)
+    return tokens
+
+
+def _terms(movie):
+    tf = Counter()
+    for token in tokenize(movie.title):
+        tf[token] += TITLE_WEIGHT
+    for token in tokenize(movie.info):
+        tf[token] += INFO_WEIGHT
+    return tf
+
+
+def index_movie(movie, pipe=None):
+    """
+    建立（或更新）一部电影的索引；传入 pipe 时只追加命令不执行（用于全量重建）
+    """
+    execute = pipe is None
+    if execute:
+        remove_movie(movie.id)
+    tf = _terms(movie)
+    if not tf:
+        return
+    pipe = rd.pipeline() if execute else pipe
+    for token, num in tf.items():
+        pipe.hset(TERM_KEY + token, movie.id, num)
+    pipe.hmset(DOC_KEY + str(movie.id), dict(tf))
+    length = sum(tf.values())
+    pipe.hset(LEN_KEY, movie.id, length)
+    pipe.hincrby(STATS_KEY, "len", length)
+    if execute:
+        pipe.execute()
+
+
+def remove_movie(movie_id):
+    doc = rd.hgetall(DOC_KEY + str(movie_id))
+    if not doc:
+        return
+    pipe = rd.pipeline()
+    for token in doc:
+        pipe.hdel(TERM_KEY + _str(token), movie_id)
+    pipe.delete(DOC_KEY + str(movie_id))
+    pipe.hdel(LEN_KEY, movie_id)
+    pipe.hincrby(STATS_KEY, "len", -sum(int(v) for v in doc.values()))
+    pipe.execute()
+
+
+def rebuild(batch=500):
+    """
+    清空并重建全部索引，返回索引的电影数量
+    """
+    rd.delete(READY_KEY)
+    for pattern in (TERM_KEY + "*", DOC_KEY + "*"):
+        keys = list(rd.scan_iter(match=pattern, count=1000))
+        for i in range(0, len(keys), 1000):
+            rd.delete(*keys[i:i + 1000])
+    rd.delete(LEN_KEY, STATS_KEY)
+    num = 0
+    pipe = rd.pipeline()
+    for movie in Movie.query.order_by(Movie.id.asc()).yield_per(batch):
+        index_movie(movie, pipe)
+        num += 1
+        if num % batch == 0:
+            pipe.execute()
+    pipe.execute()
+    rd.set(READY_KEY, 1)
+    return num
+
+
+def ready():
+    """
+    索引是否已经建立；没有建立时在后台线程中开始建立（多个进程只有一个执行）并返回 False
+    """
+    if rd.exists(READY_KEY):
+        return True
+    if rd.set(BUILD_LOCK_KEY, 1, nx=True, ex=BUILD_TIMEOUT):
+        thread = threading.Thread(target=_build, name="search-rebuild")
+        thread.daemon = True
+        thread.start()
+    return False
+
+
+def _build():
+    try:
+        with app.app_context():
+            app.logger.info("indexed %d movies for search", rebuild())
+            db.session.remove()
+    except Exception:
+        app.logger.exception("search index rebuild failed")
+    finally:
+        rd.delete(BUILD_LOCK_KEY)
+
+
+def search(key, page=1, per_page=3):
+    """
+    返回当前页电影 id（按 BM25 得分排序）和命中总数；
+    所有查询词都要命中，与原来的子串匹配语义一致
+    """
+    tokens = list(set(tokenize(key, query=True)))
+    if not tokens:
+        return [], 0
+    pipe = rd.pipeline()
+    for token in tokens:
+        pipe.hlen(TERM_KEY + token)
+    pipe.hlen(LEN_KEY)
+    pipe.hget(STATS_KEY, "len")
+    result = pipe.execute()
+    sizes, n, total_len = dict(zip(tokens, result[:-2])), result[-2], result[-1]
+    if not n or not all(sizes.values()):
+        return [], 0
+
+    # 从最稀有的词开始：只完整读取它的倒排表，其余的词按候选电影 HMGET，候选逐步缩小
+    tokens.sort(key=lambda token: sizes[token])
+    matched = dict(
+        (int(mid), [(sizes[tokens[0]], int(tf))]) for mid, tf in rd.hgetall(TERM_KEY + tokens[0]).items()
+    )
+    for token in tokens[1:]:
+        if not matched:
+            break
+        ids = sorted(matched)
+        matched = dict(
+            (mid, matched[mid] + [(sizes[token], int(tf))])
+            for mid, tf in zip(ids, rd.hmget(TERM_KEY + token, ids)) if tf is not None
+        )
+    if not matched:
+        return [], 0
+
+    ids = sorted(matched)
+    lengths = dict(zip(ids, (int(v or 0) for v in rd.hmget(LEN_KEY, ids))))
+    avgdl = float(total_len or 1) / n
+    scores = {}
+    for mid, hits in matched.items():
+        norm = K1 * (1 - B + B * lengths[mid] / avgdl)
+        scores[mid] = sum(
+            math.log(1 + (n - df + 0.5) / (df + 0.5)) * tf * (K1 + 1) / (tf + norm)
+            for df, tf in hits
+        )
+
+    ranked = sorted(ids, key=lambda mid: (-scores[mid], mid))
+    start = (page - 1) * per_page
+    return ranked[start:start + per_page], len(ranked)
+
+
+def _str(value):
+    return value.decode() if isinstance(value, bytes) else value
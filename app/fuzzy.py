@@ -0,0 +1,147 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+
+from app import app, db, cache
+from app.models import Movie
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午6:20"
+
+# 检查片库版本号的间隔（秒），片库变化后由后台线程重建索引
+CHECK_INTERVAL = 5
+
+# 低于该相似度的标题不返回
+MIN_SCORE = 0.3
+
+STRIP_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def trigrams(text):
+    """
+    标题的三元组集合：去掉空白和标点并转小写，首尾补空格让短标题和首尾字符也有足够的三元组
+    """
+    text = STRIP_RE.sub("", (text or "").lower())
+    if not text:
+        return set()
+    text = "  " + text + " "
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class TrigramIndex(object):
+    """
+    电影标题的三元组倒排索引，按 Dice 系数返回最相近的标题；
+    倒排表用 array 存放下标，整个片库常驻每个进程内存
+    """
+
+    def __init__(self, rows=()):
+        self.ids = array("I")
+        self.sizes = array("H")
+        postings = {}
+        for mid, title in rows:
+            grams = trigrams(title)
+            if not grams:
+                continue
+            pos = len(self.ids)
+            self.ids.append(mid)
+            self.sizes.append(min(len(grams), 65535))
+            for gram in grams:
+                postings.setdefault(gram, []).append(pos)
+        self.postings = dict((gram, array("I", v)) for gram, v in postings.items())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def top(self, text, k=10, budget=0.005):
+        """
+        返回 [(电影id, 相似度)]；先处理最稀有的三元组，超出时间预算（秒）时用已累计的结果
+        """
+        grams = trigrams(text)
+        if not grams:
+            return []
+        deadline = time.time() + budget
+        lists = sorted((self.postings[g] for g in grams if g in self.postings), key=len)
+        overlap = {}
+        for positions in lists:
+            for pos in positions:
+                overlap[pos] = overlap.get(pos, 0) + 1
+            if time.time() > deadline:
+                break
+        size = len(grams)
+        scored = (
+            (2.0 * num / (size + self.sizes[pos]), pos)
+            for pos, num in overlap.items()
+        )
+        best = heapq.nlargest(k, (v for v in scored if v[0] >= MIN_SCORE))
+        return [(self.ids[pos], score) for score, pos in best]
+
+
+class FuzzyMatcher(object):
+    """
+    片库版本号变化后在后台线程中重建索引，重建期间请求继续使用旧索引
+    """
+
+    def __init__(self):
+        self.index = None
+        self.version = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="fuzzy-rebuild")
+                self.thread.daemon = True
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            try:
+                with app.app_context():
+                    self.rebuild()
+                    db.session.remove()
+            except Exception:
+                app.logger.exception("fuzzy index rebuild failed")
+
+    def _build(self):
+        # 先取版本号再读标题，期间的变化会在下次检查时再重建一次
+        version = cache.catalog_version()
+        return version, TrigramIndex(db.session.query(Movie.id, Movie.title).all())
+
+    def rebuild(self):
+        version, index = self._build()
+        with self.lock:
+            self.index = index
+            self.version = version
+
+    def get_index(self):
+        now = time.time()
+        if self.index is not None and now - self.checked_at <= CHECK_INTERVAL:
+            return self.index
+        self.start()
+        with self.lock:
+            if self.index is None:
+                # 首次使用时同步加载
+                self.version, self.index = self._build()
+                self.checked_at = now
+            elif now - self.checked_at > CHECK_INTERVAL:
+                if cache.catalog_version() != self.version:
+                    self.wake.set()
+                self.checked_at = now
+        return self.index
+
+
+matcher = FuzzyMatcher()
+
+
+def similar(text, k=10, budget=0.005):
+    """
+    与 text 最相近的 k 部电影的 id，按相似度从高到低
+    """
+    return [mid for mid, score in matcher.get_index().top(text, k=k, budget=budget)]
@@ -1,26 +1,24 @@
-import os
 import uuid
-from datetime import datetime
 from functools import wraps
 from werkzeug.utils import secure_filename
 
-from app import db, app, rd
+from app import db, app, rd, cache, counters, danmaku, facets, fulltext, fuzzy, live, media, paging, \
+    storage, suggest, thumbs, wordfilter
+from app import comments as comment_store
+from app.snapshot import get_snapshot
 from app.home import home
-from flask import render_template, redirect, url_for, flash, request, session, Response
+from flask import render_template, redirect, url_for, flash, request, session, Response, abort
+from flask_sqlalchemy import Pagination
+from sqlalchemy.orm import contains_eager
 
 from app.home.forms import RegisterForm, LoginForm, UserDetailForm, PwdForm, CommentForm
 from app.models import User, UserLog, Preview, Tag, Movie, Comment, MovieCol
-from werkzeug.security import generate_password_hash
+from werkzeug.security import generate_password_hash, safe_join
 
 __author__ = "TuDi"
 __date__ = "2018/3/29 下午11:44"
 
 
-def change_filename(file_name):
-    info = os.path.splitext(file_name)
-    return datetime.now().strftime("%Y%m%d%H%M%S") + str(uuid.uuid4().hex) + info[-1]
-
-
 # 登录装饰器
 def user_login(f):
     @wraps(f)
@@ -34,50 +32,13 @@ def user_login(f):
 
 @home.route("/<int:page>/", methods=["GET"])
 def index(page=1):
-    tags = Tag.query.all()
-    page_data = Movie.query
     tid = request.args.get("tid", 0)
-    if int(tid) != 0:
-        page_data = page_data.filter_by(tag_id=int(tid))
-
     star = request.args.get("star", 0)
-    if int(star) != 0:
-        page_data = page_data.filter_by(star=int(star))
-
     time = request.args.get("time", 0)
-    if int(time) != 0:
-        if int(time) == 1:
-            page_data = page_data.order_by(
-                Movie.release_time.desc()
-            )
-        else:
-            page_data = page_data.order_by(
-                Movie.release_time.asc()
-            )
-
     play_num = request.args.get("pm", 0)
-    if int(play_num) != 0:
-        if int(play_num) == 1:
-            page_data = page_data.order_by(
-                Movie.play_num.desc()
-            )
-        else:
-            page_data = page_data.order_by(
-                Movie.play_num.asc()
-            )
-
     comm_num = request.args.get("cm", 0)
-    if int(comm_num) != 0:
-        if int(comm_num) == 1:
-            page_data = page_data.order_by(
-                Movie.comment_num.desc()
-            )
-        else:
-            page_data = page_data.order_by(
-                Movie.comment_num.asc()
-            )
-
-    page_data = page_data.paginate(page=page, per_page=8)
+    after = request.args.get("after")
+    before = request.args.get("before")
     p = dict(
         tid=tid,
         star=star,
@@ -86,7 +47,35 @@ def index(page=1):
         cm=comm_num,
 
     )
-    return render_template("home/index.html", tags=tags, p=p, page_data=page_data)
+
+    # 游客访问直接返回缓存的页面，不查询数据库
+    anonymous = "user" not in session
+    if anonymous:
+        key = cache.page_key("index", page, dict(p, after=after, before=before))
+        html = cache.get_page(key)
+        if html is not None:
+            return Response(html, mimetype="text/html")
+
+    tags = Tag.query.all()
+    snap = get_snapshot()
+    if snap is not None and not (after or before):
+        # 内存快照中完成筛选、排序、分页，只回表读取当前页
+        page_data = snap.paginate(p, page=page, per_page=8)
+    else:
+        page_data = Movie.query
+        if int(tid) != 0:
+            page_data = page_data.filter_by(tag_id=int(tid))
+
+        if int(star) != 0:
+            page_data = page_data.filter_by(star=int(star))
+
+        # 按 release_time/play_num/comment_num + id 游标分页，避免深翻页时的 COUNT(*) 和 OFFSET 扫描
+        page_data = paging.paginate(page_data, p, page=page, per_page=8, after=after, before=before)
+    counts = facets.filter_counts(p)
+    html = render_template("home/index.html", tags=tags, p=p, page_data=page_data, counts=counts)
+    if anonymous:
+        cache.set_page(key, html)
+    return html
 
 
 @home.route("/animation/")
@@ -173,18 +162,19 @@ def user():
             flash("手机号已经注册", "err")
             return redirect(url_for("home.user"))
 
-        if not os.path.exists(app.config["UP_DIR"] + "users/"):
-            os.makedirs(app.config["UP_DIR"] + "users/")
+        old_face = None
         if hasattr(form.face.data, "filename"):
             file_name = secure_filename(form.face.data.filename)
-            user.face = change_filename(file_name)
-            form.face.data.save(app.config["UP_DIR"] + "users/" + user.face)
+            old_face = user.face
+            user.face = storage.save(form.face.data.stream, file_name, storage.USERS)
+            thumbs.generate(user.face, "avatar", storage.USERS)
         user.name = data["name"]
         user.email = data["email"]
         user.phone = data["phone"]
         user.info = data["info"]
         db.session.add(user)
         db.session.commit()
+        storage.release(old_face, storage.USERS)
         flash("个人信息修改成功", "ok")
         return redirect(url_for("home.user"))
     return render_template("home/user.html", form=form, user=user)
@@ -215,6 +205,8 @@ def comments(page=1):
     ).filter(
         Movie.id == Comment.movie_id,
         User.id == session["user_id"]
+    ).options(
+        contains_eager(Comment.user).load_only("name", "face")
     ).order_by(
         Comment.add_time.desc()
     ).paginate(page=page, per_page=2)
@@ -244,6 +236,8 @@ def moviecol(page=1):
     ).filter(
         User.id == session["user_id"],
         Movie.id == MovieCol.movie_id
+    ).options(
+        contains_eager(MovieCol.movie).load_only("title", "logo", "info")
     ).order_by(
         MovieCol.add_time.desc()
     ).paginate(page=page, per_page=1)
@@ -276,80 +270,169 @@ def moviecol_add():
 @home.route("/search/<int:page>/", methods=["GET"])
 def search(page=1):
     key = request.args.get("key", "")
-    movie_count = Movie.query.filter(
-        Movie.title.ilike("%" + key + "%")
-    ).count()
+    similar = False
+    if not fulltext.tokenize(key, query=True):
+        # 没有可检索的词时与原来一样列出全部电影
+        page_data = Movie.query.paginate(page=page, per_page=3)
+        movie_count = page_data.total
+    elif not fulltext.ready():
+        # 倒排索引正在后台建立，先按原来的标题子串匹配
+        page_data = Movie.query.filter(
+            Movie.title.ilike("%" + key + "%")
+        ).paginate(page=page, per_page=3)
+        movie_count = page_data.total
+    else:
+        # 倒排索引一次返回当前页和命中总数，按 BM25 得分排序
+        ids, movie_count = fulltext.search(key, page=page, per_page=3)
+        if not movie_count:
+            # 没有精确命中时按标题三元组相似度给出最接近的电影，容忍输错字
+            similar = fuzzy.similar(key, k=9)
+            movie_count = len(similar)
+            ids = similar[(page - 1) * 3:page * 3]
+        movies = dict((m.id, m) for m in Movie.query.filter(Movie.id.in_(ids)).all()) if ids else {}
+        page_data = Pagination(None, page, 3, movie_count, [movies[v] for v in ids if v in movies])
+    return render_template(
+        "home/search.html", page_data=page_data, key=key, movie_count=movie_count, similar=bool(similar)
+    )
+
 
-    page_data = Movie.query.filter(
-        Movie.title.ilike("%" + key + "%")
-    ).paginate(page=page, per_page=3)
-    return render_template("home/search.html", page_data=page_data, key=key, movie_count=movie_count)
+@home.route("/search/suggest/", methods=["GET"])
+def search_suggest():
+    # 搜索框输入提示，数据来自进程内的前缀索引，不查询数据库
+    import json
+    key = request.args.get("key", "")
+    data = [dict(id=mid, title=title) for mid, title in suggest.suggest(key)]
+    return Response(json.dumps(dict(code=1, data=data)), mimetype='application/json')
 
 
 @home.route("/play/<int:id>", methods=["GET", "POST"])
 def play(id=1):
-    movie = Movie.query.join(Tag).filter(Tag.id == Movie.tag_id, Movie.id == id).first_or_404()
+    movie = Movie.query.join(Tag).filter(
+        Tag.id == Movie.tag_id, Movie.id == id
+    ).options(
+        contains_eager(Movie.tag)
+    ).first_or_404()
     form = CommentForm()
-    movie.play_num += 1
+    # 播放量先累计在 Redis，由后台线程批量写回数据库，页面显示数据库值加未写回的增量
+    play_num = (movie.play_num or 0) + counters.incr_play(movie.id)
     if form.validate_on_submit():
         data = form.data
-        comment = Comment(
-            content=data["content"],
-            movie_id=movie.id,
-            user_id=session["user_id"]
-        )
-        db.session.add(comment)
-        db.session.commit()
-        movie.comment_num += 1
-        flash("评论成功", "ok")
-    db.session.add(movie)
-    db.session.commit()
-    page = int(request.args.get("page", 1))
-    page_data = Comment.query.join(
-        Movie
-    ).join(
-        User
-    ).filter(
-        Movie.id == movie.id,
-        User.id == Comment.user_id
-    ).order_by(
-        Comment.add_time.desc()
-    ).paginate(page=page, per_page=1)
+        # 敏感词过滤：拒绝、替换为*，或原样保存并标记待审
+        checked = wordfilter.check(data["content"])
+        if checked.policy == wordfilter.REJECT:
+            flash("评论包含敏感词，请修改后再提交", "err")
+        else:
+            comment = Comment(
+                content=checked.text,
+                movie_id=movie.id,
+                user_id=session["user_id"]
+            )
+            db.session.add(comment)
+            db.session.commit()
+            movie.comment_num += 1
+            db.session.add(movie)
+            db.session.commit()
+            comment_store.bump(movie.id)
+            if checked.policy == wordfilter.FLAG:
+                wordfilter.flag("comment", comment.id, movie.id, checked.text, checked.words)
+            flash("评论成功", "ok")
 
-    return render_template("home/play.html", movie=movie, form=form, page_data=page_data)
+    return render_template("home/play.html", movie=movie, form=form, play_num=play_num)
 
 
 @home.route("/video/<int:id>", methods=["GET", "POST"])
 def video(id=1):
-    movie = Movie.query.join(Tag).filter(Tag.id == Movie.tag_id, Movie.id == id).first_or_404()
+    movie = Movie.query.join(Tag).filter(
+        Tag.id == Movie.tag_id, Movie.id == id
+    ).options(
+        contains_eager(Movie.tag)
+    ).first_or_404()
     form = CommentForm()
-    movie.play_num += 1
+    # 播放量先累计在 Redis，由后台线程批量写回数据库，页面显示数据库值加未写回的增量
+    play_num = (movie.play_num or 0) + counters.incr_play(movie.id)
     if form.validate_on_submit():
         data = form.data
-        comment = Comment(
-            content=data["content"],
-            movie_id=movie.id,
-            user_id=session["user_id"]
-        )
-        db.session.add(comment)
-        db.session.commit()
-        movie.comment_num += 1
-        flash("评论成功", "ok")
-    db.session.add(movie)
-    db.session.commit()
-    page = int(request.args.get("page", 1))
-    page_data = Comment.query.join(
-        Movie
-    ).join(
-        User
-    ).filter(
-        Movie.id == movie.id,
-        User.id == Comment.user_id
-    ).order_by(
-        Comment.add_time.desc()
-    ).paginate(page=page, per_page=1)
+        # 敏感词过滤：拒绝、替换为*，或原样保存并标记待审
+        checked = wordfilter.check(data["content"])
+        if checked.policy == wordfilter.REJECT:
+            flash("评论包含敏感词，请修改后再提交", "err")
+        else:
+            comment = Comment(
+                content=checked.text,
+                movie_id=movie.id,
+                user_id=session["user_id"]
+            )
+            db.session.add(comment)
+            db.session.commit()
+            movie.comment_num += 1
+            db.session.add(movie)
+            db.session.commit()
+            comment_store.bump(movie.id)
+            if checked.policy == wordfilter.FLAG:
+                wordfilter.flag("comment", comment.id, movie.id, checked.text, checked.words)
+            flash("评论成功", "ok")
+
+    return render_template("home/video.html", movie=movie, form=form, play_num=play_num)
+
+
+@home.route("/comment/<int:id>/", methods=["GET"])
+def comment_thread(id=1):
+    # 播放页评论列表，按游标逐页加载，不重新加载播放器
+    return Response(comment_store.thread(id, request.args.get("cursor")), mimetype='application/json')
+
+
+@home.route("/media/<path:filename>", methods=["GET", "HEAD"])
+def media_file(filename):
+    # 上传的视频：支持拖动进度条时的区间请求，可配置交给 nginx/Apache 发送
+    path = safe_join(app.config["UP_DIR"], filename)
+    if path is None:
+        abort(404)
+    return media.send(request, path, filename)
+
+
+@home.route("/thumbs/<path:filename>", methods=["GET", "HEAD"])
+def thumb(filename):
+    # 封面、预告和头像的缩略图：缺少时现场生成，无法生成时跳转到原图
+    info = thumbs.parse(filename)
+    if info is None or safe_join(app.config["UP_DIR"], info[2]) is None:
+        abort(404)
+    path = thumbs.render(*info)
+    if path is None:
+        return redirect(url_for("static", filename="uploads/" + info[2]))
+    return media.send(request, path, thumbs.THUMB_DIR + filename)
+
+
+@home.route("/tm/live/<int:id>/", methods=["GET"])
+def tm_live(id=1):
+    # 新弹幕实时推送（Server-Sent Events），每个进程的连接数有上限
+    if live.hub.full():
+        return Response("", status=503, headers={"Retry-After": "10"})
+    return Response(
+        live.stream(id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    return render_template("home/video.html", movie=movie, form=form, page_data=page_data)
+
+@home.route("/tm/histogram/<int:id>/", methods=["GET"])
+def tm_histogram(id=1):
+    # 每 bucket 秒播放时间内的弹幕数，用于在进度条上绘制弹幕热度
+    import json
+    tag = danmaku.etag(id)
+    if request.if_none_match.contains(tag):
+        resp = Response(status=304)
+        resp.set_etag(tag)
+        return resp
+    width = request.args.get("bucket", danmaku.HISTOGRAM_BUCKET, type=int)
+    width = max(width // danmaku.HISTOGRAM_BUCKET, 1) * danmaku.HISTOGRAM_BUCKET
+    resp = Response(json.dumps(dict(
+        code=1,
+        bucket=width,
+        counts=danmaku.histogram(id, width)
+    )), mimetype="application/json")
+    resp.set_etag(tag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
 @home.route("/tm/", methods=["GET", "POST"])
@@ -358,39 +441,55 @@ def tm():
     if request.method == "GET":
         #获取弹幕消息队列
         id = request.args.get('id')
-        key = "movie" + str(id)
-        if rd.llen(key):
-            msgs = rd.lrange(key, 0, 2999)
-            res = {
-                "code": 1,
-                "danmaku": [json.loads(v) for v in msgs]
-            }
-        else:
-            res = {
-                "code": 1,
-                "danmaku": []
-            }
-        resp = json.dumps(res)
+        # 客户端带着上次的 ETag 轮询且期间弹幕没有变化时直接返回 304，不读取弹幕
+        if request.if_none_match:
+            tag = danmaku.etag(id)
+            if request.if_none_match.contains(tag):
+                resp = Response(status=304)
+                resp.set_etag(tag)
+                return resp
+        # from/to（秒）只取即将播放的时间段，不传时返回整部电影的弹幕
+        version, body = danmaku.read(
+            id,
+            request.args.get('from', type=float),
+            request.args.get('to', type=float)
+        )
+        resp = Response(body, mimetype='application/json')
+        resp.set_etag(str(version))
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
     if request.method == "POST":
         #添加弹幕
         data = json.loads(request.get_data())
-        msg = {
-            "__v": 0,
-            "author": data["author"],
-            "time": data["time"],
-            "text": data["text"],
-            "color": data["color"],
-            "type": data['type'],
-            "ip": request.remote_addr,
-            "_id": datetime.now().strftime("%Y%m%d%H%M%S") + uuid.uuid4().hex,
-            "player": [
-                data["player"]
-            ]
-        }
-        res = {
-            "code": 1,
-            "data": msg
-        }
+        # 客户端可能发送数字等非字符串内容，与导入时一样统一转换为字符串
+        text = data.get("text")
+        checked = wordfilter.check("" if text is None else "%s" % text)
+        if checked.policy == wordfilter.REJECT:
+            res = {
+                "code": 0,
+                "msg": "弹幕包含敏感词"
+            }
+        else:
+            data["text"] = checked.text
+            try:
+                msg = danmaku.push(data, request.remote_addr)
+            except ValueError:
+                res = {
+                    "code": 0,
+                    "msg": "弹幕时间不正确"
+                }
+            else:
+                if msg is None:
+                    res = {
+                        "code": 0,
+                        "msg": "发送太频繁，请稍后再试"
+                    }
+                else:
+                    if checked.policy == wordfilter.FLAG:
+                        wordfilter.flag("danmaku", msg["_id"], data["player"], checked.text, checked.words)
+                    res = {
+                        "code": 1,
+                        "data": msg
+                    }
         resp = json.dumps(res)
-        rd.lpush("movie" + str(data["player"]), json.dumps(msg))
-    return Response(resp, mimetype='application/json')
\ No newline at end of file
+    return Response(resp, mimetype='application/json')
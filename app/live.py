@@ -0,0 +1,134 @@
+import threading
+import time
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+from app import app, rd
+from app.danmaku import LIVE_CHANNEL as CHANNEL
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午10:15"
+
+# 新弹幕发布到 CHANNEL，每个进程只订阅一次模式频道，再分发给本进程的所有连接
+PATTERN = CHANNEL.format("*")
+
+# 每个进程最多保持的推送连接数
+MAX_CONNECTIONS = 200
+# 每个连接最多积压的消息数，超过后断开这个慢连接，由浏览器自动重连
+QUEUE_SIZE = 256
+# 心跳间隔（秒），防止代理因空闲断开连接
+HEARTBEAT = 15
+
+
+class Hub(object):
+    """
+    Redis pub/sub -> 本进程各个 SSE 连接的分发器
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.listeners = {}
+        self.count = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self, movie_id):
+        """
+        返回接收消息的队列；连接数已满时返回 None
+        """
+        with self.lock:
+            if self.count >= self.max_connections:
+                return None
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="danmaku-live")
+                self.thread.daemon = True
+                self.thread.start()
+            queue = Queue(QUEUE_SIZE)
+            self.listeners.setdefault(str(movie_id), set()).add(queue)
+            self.count += 1
+            return queue
+
+    def full(self):
+        with self.lock:
+            return self.count >= self.max_connections
+
+    def unsubscribe(self, movie_id, queue):
+        with self.lock:
+            queues = self.listeners.get(str(movie_id))
+            if queues and queue in queues:
+                queues.discard(queue)
+                self.count -= 1
+                if not queues:
+                    del self.listeners[str(movie_id)]
+
+    def publish(self, movie_id, data):
+        with self.lock:
+            queues = list(self.listeners.get(str(movie_id), ()))
+        for queue in queues:
+            try:
+                queue.put_nowait(data)
+            except Full:
+                # 慢连接：清空积压并通知其断开
+                self._close(queue)
+
+    def _close(self, queue):
+        while True:
+            try:
+                queue.get_nowait()
+            except Empty:
+                break
+        try:
+            queue.put_nowait(None)
+        except Full:
+            pass
+
+    def _run(self):
+        while True:
+            try:
+                pubsub = rd.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(PATTERN)
+                for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode("utf8")
+                    self.publish(channel.split(":")[1], data)
+            except Exception:
+                app.logger.exception("danmaku live subscription failed")
+                time.sleep(1)
+
+
+hub = Hub()
+
+
+def stream(movie_id):
+    """
+    SSE 响应体生成器：开始发送时才占用连接，与注销在同一个 try/finally 中，
+    响应没有被迭代（客户端提前断开）时不会占着连接数
+    """
+    queue = None
+    try:
+        queue = hub.subscribe(movie_id)
+        yield "retry: 3000\n\n"
+        if queue is None:
+            # 检查之后连接数被占满，让浏览器稍后重连
+            return
+        while True:
+            try:
+                data = queue.get(timeout=HEARTBEAT)
+            except Empty:
+                yield ": ping\n\n"
+                continue
+            if data is None:
+                break
+            yield "data: %s\n\n" % data
+    finally:
+        if queue is not None:
+            hub.unsubscribe(movie_id, queue)
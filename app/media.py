@@ -0,0 +1,237 @@
+import os
+import random
+import re
+import time
+import uuid
+from email.utils import formatdate
+
+from flask import Response, abort
+
+from app import app
+
+__author__ = "TuDi"
+__date__ = "2026/10/19 上午1:05"
+
+# 未在 app.config 中配置 MEDIA_OFFLOAD / MEDIA_ACCEL_PREFIX 时的默认值
+OFFLOAD = None
+ACCEL_PREFIX = "/protected-uploads/"
+
+# 应用自己发送时每次读取的字节数
+CHUNK_SIZE = 256 * 1024
+# 一个请求最多允许的区间数，防止构造大量小区间的请求
+MAX_RANGES = 16
+MAX_AGE = 7 * 24 * 3600
+
+RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+MIME_TYPES = {
+    ".mp4": "video/mp4",
+    ".m4v": "video/mp4",
+    ".webm": "video/webm",
+    ".ogv": "video/ogg",
+    ".flv": "video/x-flv",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+
+def parse_ranges(header, size):
+    """
+    解析 Range 请求头，返回 [(开始, 结束)]（含结束位置）；无法解析时返回 None，表示忽略该请求头，
+    所有区间都超出文件范围时返回 []，应返回 416。相邻或重叠的区间会合并
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    ranges = []
+    for spec in header[6:].split(","):
+        match = RANGE_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        elif last:
+            # 后缀区间：最后 n 个字节
+            start = max(size - int(last), 0)
+            end = size - 1
+            if not int(last):
+                continue
+        else:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFile(object):
+    """
+    文件中 [start, start + length) 的一段：read() 不会超出这一段，
+    fileno() 供 gunicorn 等服务器按当前位置和 Content-Length 用 sendfile 零拷贝发送
+    """
+
+    def __init__(self, f, start, length):
+        self.f = f
+        self.remaining = length
+        f.seek(start)
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def read(self, size=CHUNK_SIZE):
+        if self.remaining <= 0:
+            return b""
+        data = self.f.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def _iter_file(f, size=CHUNK_SIZE):
+    try:
+        while True:
+            data = f.read(size)
+            if not data:
+                break
+            yield data
+    finally:
+        f.close()
+
+
+def _iter_multipart(f, ranges, size, boundary, mimetype):
+    try:
+        for start, end in ranges:
+            yield ("\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % (
+                boundary, mimetype, start, end, size
+            )).encode("latin-1")
+            part = RangeFile(f, start, end - start + 1)
+            while True:
+                data = part.read()
+                if not data:
+                    break
+                yield data
+        yield ("\r\n--%s--\r\n" % boundary).encode("latin-1")
+    finally:
+        f.close()
+
+
+def _multipart_length(ranges, size, boundary, mimetype):
+    length = len("\r\n--%s--\r\n" % boundary)
+    for start, end in ranges:
+        length += len("\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" % (
+            boundary, mimetype, start, end, size
+        )) + end - start + 1
+    return length
+
+
+def etag_for(stat):
+    # 上传的文件不会原地修改，inode + 大小 + 修改时间足以区分内容
+    return "%x-%x-%x" % (stat.st_ino, stat.st_size, int(stat.st_mtime * 1000000))
+
+
+def send(request, path, relpath, offload=None):
+    """
+    发送 path 指向的文件，支持 HEAD、条件请求（ETag/If-Range）和单区间/多区间 Range 请求；
+    relpath 为相对上传目录的路径，用于前端服务器转发
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+    size = stat.st_size
+    etag = etag_for(stat)
+    mimetype = MIME_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=%d" % MAX_AGE,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+    }
+
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304, headers=headers)
+        resp.set_etag(etag)
+        return resp
+
+    offload = offload if offload is not None else app.config.get("MEDIA_OFFLOAD", OFFLOAD)
+    if offload == "x-accel":
+        # 区间请求由 nginx 处理
+        headers["X-Accel-Redirect"] = app.config.get("MEDIA_ACCEL_PREFIX", ACCEL_PREFIX) + relpath
+        resp = Response(mimetype=mimetype, headers=headers)
+        resp.set_etag(etag)
+        return resp
+    if offload == "x-sendfile":
+        headers["X-Sendfile"] = path
+        resp = Response(mimetype=mimetype, headers=headers)
+        resp.set_etag(etag)
+        return resp
+
+    ranges = parse_ranges(request.headers.get("Range"), size)
+    if_range = request.headers.get("If-Range")
+    if ranges is not None and if_range and if_range.strip('"') != etag:
+        # 文件已经变化，返回完整内容
+        ranges = None
+    if ranges == []:
+        headers["Content-Range"] = "bytes */%d" % size
+        return Response(status=416, headers=headers)
+
+    f = None if request.method == "HEAD" else open(path, "rb")
+    wrapper = request.environ.get("wsgi.file_wrapper")
+    if not ranges:
+        status = 200
+        length = size
+        body = RangeFile(f, 0, size) if f else []
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        status = 206
+        length = end - start + 1
+        headers["Content-Range"] = "bytes %d-%d/%d" % (start, end, size)
+        body = RangeFile(f, start, length) if f else []
+    else:
+        status = 206
+        boundary = uuid.uuid4().hex
+        length = _multipart_length(ranges, size, boundary, mimetype)
+        body = _iter_multipart(f, ranges, size, boundary, mimetype) if f else []
+        mimetype = "multipart/byteranges; boundary=%s" % boundary
+
+    if isinstance(body, RangeFile):
+        body = wrapper(body, CHUNK_SIZE) if wrapper else _iter_file(body)
+    headers["Content-Length"] = str(length)
+    resp = Response(body, status=status, content_type=mimetype, headers=headers, direct_passthrough=True)
+    resp.set_etag(etag)
+    return resp
+
+
+def benchmark(client, url, size, num=200, length=64 * 1024):
+    """
+    对 url 发起 num 次随机位置的区间请求（模拟拖动进度条），返回 (平均, p50, p99) 毫秒
+    """
+    costs = []
+    for _ in range(num):
+        start = random.randint(0, max(size - length, 0))
+        begin = time.time()
+        resp = client.get(url, headers={"Range": "bytes=%d-%d" % (start, start + length - 1)})
+        resp.get_data()
+        costs.append((time.time() - begin) * 1000)
+        assert resp.status_code == 206, resp.status_code
+    costs.sort()
+    return sum(costs) / len(costs), costs[len(costs) // 2], costs[min(int(len(costs) * 0.99), len(costs) - 1)]
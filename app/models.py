@@ -19,7 +19,7 @@ class User(db.Model):
     email = db.Column(db.String(100), unique=True)  # 邮箱
     phone = db.Column(db.String(11), unique=True)  # 手机号码
     info = db.Column(db.Text)  # 个性简介
-    face = db.Column(db.String(255), unique=True)  # 头像
+    face = db.Column(db.String(255))  # 头像（按内容保存，相同的图片共用一个文件）
     add_time = db.Column(db.DateTime, index=True, default=datetime.now)  # 添加时间
     uuid = db.Column(db.String(255), unique=True)  # 唯一标志符
     user_logs = db.relationship("UserLog", backref="user")  # 会员日志外键关系关联
@@ -69,9 +69,9 @@ class Movie(db.Model):
     __tablename__ = "movie"
     id = db.Column(db.Integer, primary_key=True)  # 编号
     title = db.Column(db.String(255), unique=True)  # 标题
-    url = db.Column(db.String(255), unique=True)  # 地址
+    url = db.Column(db.String(255))  # 地址（按内容保存，相同的文件共用一个路径）
     info = db.Column(db.Text)  # 简介
-    logo = db.Column(db.String(255), unique=True)  # 封面
+    logo = db.Column(db.String(255))  # 封面
     star = db.Column(db.SmallInteger)  # 星级
     play_num = db.Column(db.BigInteger)  # 播放量
     comment_num = db.Column(db.BigInteger)  # 评论量
@@ -79,6 +79,10 @@ class Movie(db.Model):
     area = db.Column(db.String(255))  # 上映地区
     release_time = db.Column(db.Date)  # 上映时间
     length = db.Column(db.String(100))  # 播放时间
+    duration = db.Column(db.Float)  # 时长（秒），上传 MP4 时自动读取
+    width = db.Column(db.Integer)  # 视频宽度
+    height = db.Column(db.Integer)  # 视频高度
+    bitrate = db.Column(db.Integer)  # 平均码率（bit/s）
     add_time = db.Column(db.DateTime, index=True, default=datetime.now)  # 添加时间
     comments = db.relationship("Comment", backref='movie')  # 评论外键关系关联
     movie_cols = db.relationship("MovieCol", backref='movie')  # 收藏外键关系关联
@@ -94,7 +98,7 @@ class Preview(db.Model):
     __tablename__ = "preview"
     id = db.Column(db.Integer, primary_key=True)  # 编号
     title = db.Column(db.String(255), unique=True)  # 标题
-    logo = db.Column(db.String(255), unique=True)  # 封面
+    logo = db.Column(db.String(255))  # 封面
     add_time = db.Column(db.DateTime, index=True, default=datetime.now)  # 添加时间
 
     def __repr__(self):
@@ -170,8 +174,9 @@ class Admin(db.Model):
     is_super = db.Column(db.SmallInteger)  # 是否为超级管理员，0为超级管理员
     role_id = db.Column(db.Integer, db.ForeignKey('role.id'))  # 所属角色
     add_time = db.Column(db.DateTime, index=True, default=datetime.now)  # 添加时间
-    admin_logs = db.relationship("AdminLog", backref='admin')  # 管理员登录日志外键关系关联
-    op_logs = db.relationship("OpLog", backref='admin')  # 管理员操作日志外键关系关联
+    # 管理员表很小，日志随主表 JOIN 加载所属管理员，避免日志列表逐行查询
+    admin_logs = db.relationship("AdminLog", backref=db.backref('admin', lazy='joined'))  # 管理员登录日志外键关系关联
+    op_logs = db.relationship("OpLog", backref=db.backref('admin', lazy='joined'))  # 管理员操作日志外键关系关联
 
     def __repr__(self):
         return "<Admin %r>" % self.name
@@ -210,6 +215,42 @@ class OpLog(db.Model):
         return "<OpLog %r>" % self.id
 
 
+class Danmaku(db.Model):
+    """
+    归档弹幕模型类（超出保留策略、从 Redis 淘汰的弹幕）
+    """
+    __tablename__ = "danmaku"
+    __table_args__ = (db.Index("ix_danmaku_movie_time", "movie_id", "time"),)
+    id = db.Column(db.Integer, primary_key=True)  # 编号
+    uid = db.Column(db.String(64), unique=True)  # 弹幕唯一标志符（_id）
+    movie_id = db.Column(db.Integer)  # 所属电影，不加外键，删除电影时保留归档
+    author = db.Column(db.String(100))  # 发送者
+    time = db.Column(db.Float)  # 播放时间（秒）
+    text = db.Column(db.String(600))  # 内容
+    color = db.Column(db.String(20))  # 颜色
+    type = db.Column(db.String(20))  # 类型
+    ip = db.Column(db.String(100))  # 发送IP
+    add_time = db.Column(db.DateTime, index=True)  # 发送时间
+    archive_time = db.Column(db.DateTime, default=datetime.now)  # 归档时间
+
+    def __repr__(self):
+        return "<Danmaku %r>" % self.id
+
+
+class SensitiveWord(db.Model):
+    """
+    敏感词模型类
+    """
+    __tablename__ = "sensitive_word"
+    id = db.Column(db.Integer, primary_key=True)  # 编号
+    word = db.Column(db.String(100), unique=True)  # 敏感词
+    policy = db.Column(db.SmallInteger, default=1)  # 处理方式：1 替换为*，2 标记待审，3 拒绝发送
+    add_time = db.Column(db.DateTime, index=True, default=datetime.now)  # 添加时间
+
+    def __repr__(self):
+        return "<SensitiveWord %r>" % self.word
+
+
 # if __name__ == '__main__':
     # db.create_all()
     # role = Role(
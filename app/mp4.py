@@ -0,0 +1,215 @@
+import os
+import shutil
+import struct
+
+from app import app
+
+__author__ = "TuDi"
+__date__ = "2026/10/19 上午1:50"
+
+# 只复制文件内容时每次读写的字节数，moov 以外的数据不会整体读入内存
+COPY_SIZE = 1024 * 1024
+# moov 超过这个大小时认为文件异常，不做处理
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+EXTENSIONS = (".mp4", ".m4v", ".mov")
+
+# 需要向下查找 stco/co64 和轨道信息的容器 box
+CONTAINERS = (b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts")
+
+
+class MP4Error(ValueError):
+    pass
+
+
+def iter_boxes(f, start, end):
+    """
+    逐个返回 [start, end) 范围内的 box：(类型, 起始位置, 头部长度, 总长度)
+    """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise MP4Error("bad box %r at %d" % (kind, pos))
+        yield kind, pos, header, size
+        pos += size
+
+
+def _iter_children(data, start, end):
+    # 与 iter_boxes 相同，作用于已读入内存的 moov
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise MP4Error("bad box %r at %d" % (kind, pos))
+        yield kind, pos, header, size
+        pos += size
+
+
+def _walk(data, start, end):
+    for kind, pos, header, size in _iter_children(data, start, end):
+        yield kind, pos, header, size
+        if kind in CONTAINERS:
+            for child in _walk(data, pos + header, pos + size):
+                yield child
+
+
+def top_level(path):
+    with open(path, "rb") as f:
+        return list(iter_boxes(f, 0, os.path.getsize(path)))
+
+
+def read_moov(path, boxes=None):
+    boxes = boxes if boxes is not None else top_level(path)
+    for kind, pos, header, size in boxes:
+        if kind == b"moov":
+            if size > MAX_MOOV_SIZE:
+                raise MP4Error("moov too large: %d" % size)
+            with open(path, "rb") as f:
+                f.seek(pos)
+                return pos, bytearray(f.read(size))
+    raise MP4Error("no moov box")
+
+
+def _shift_offsets(moov, moov_pos, delta):
+    """
+    moov 移到数据之前后，原来位于 moov 之前的数据整体后移 delta 字节，修改 stco/co64 中的块偏移
+    """
+    for kind, pos, header, size in _walk(moov, 0, len(moov)):
+        if kind not in (b"stco", b"co64"):
+            continue
+        count = struct.unpack_from(">I", moov, pos + header + 4)[0]
+        table = pos + header + 8
+        if kind == b"stco":
+            offsets = struct.unpack_from(">%dI" % count, moov, table)
+            shifted = [o + delta if o < moov_pos else o for o in offsets]
+            if shifted and max(shifted) > 0xffffffff:
+                raise MP4Error("chunk offsets overflow stco")
+            struct.pack_into(">%dI" % count, moov, table, *shifted)
+        else:
+            offsets = struct.unpack_from(">%dQ" % count, moov, table)
+            struct.pack_into(">%dQ" % count, moov, table, *[o + delta if o < moov_pos else o for o in offsets])
+
+
+def faststart(path):
+    """
+    把 moov 移到 mdat 之前，让浏览器不必先下载文件末尾就能开始播放；已经在前面时不做处理。
+    除 moov 外的内容分块复制到临时文件后替换原文件，返回是否改写了文件
+    """
+    boxes = top_level(path)
+    kinds = [box[0] for box in boxes]
+    if b"moov" not in kinds or b"mdat" not in kinds or b"moof" in kinds:
+        # 分片 MP4 不需要处理
+        return False
+    first_mdat = kinds.index(b"mdat")
+    if kinds.index(b"moov") < first_mdat:
+        return False
+    moov_pos, moov = read_moov(path, boxes)
+    _shift_offsets(moov, moov_pos, len(moov))
+
+    tmp = path + ".faststart"
+    try:
+        with open(path, "rb") as src, open(tmp, "wb") as dst:
+            for i, (kind, pos, header, size) in enumerate(boxes):
+                if i == first_mdat:
+                    dst.write(moov)
+                if kind == b"moov":
+                    continue
+                src.seek(pos)
+                _copy(src, dst, size)
+        shutil.copystat(path, tmp)
+        os.rename(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return True
+
+
+def _copy(src, dst, size):
+    while size > 0:
+        data = src.read(min(COPY_SIZE, size))
+        if not data:
+            raise MP4Error("unexpected end of file")
+        dst.write(data)
+        size -= len(data)
+
+
+def probe(path):
+    """
+    从 moov 中读取时长（秒）、视频轨道的宽高和平均码率（bit/s）
+    """
+    moov_pos, moov = read_moov(path)
+    info = dict(duration=None, width=None, height=None, bitrate=None)
+    track = None
+    for kind, pos, header, size in _walk(moov, 0, len(moov)):
+        body = pos + header
+        if kind == b"mvhd":
+            if moov[body] == 1:
+                timescale, duration = struct.unpack_from(">IQ", moov, body + 20)
+            else:
+                timescale, duration = struct.unpack_from(">II", moov, body + 12)
+            if timescale:
+                info["duration"] = float(duration) / timescale
+        elif kind == b"tkhd":
+            # 宽高为 tkhd 最后 8 个字节，16.16 定点数
+            width, height = struct.unpack_from(">II", moov, pos + size - 8)
+            track = (width >> 16, height >> 16)
+        elif kind == b"hdlr" and track is not None:
+            if moov[body + 8:body + 12] == b"vide" and info["width"] is None and track[0]:
+                info["width"], info["height"] = track
+    if info["duration"]:
+        info["bitrate"] = int(os.path.getsize(path) * 8 / info["duration"])
+    return info
+
+
+def format_length(seconds):
+    seconds = int(round(seconds))
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def prepare(path, filename=None):
+    """
+    保存前调用：MP4 文件做 faststart 改写，返回是否改写了文件；不是 MP4 或解析失败时不做处理。
+    临时文件没有扩展名时按原文件名 filename 判断
+    """
+    if os.path.splitext(filename or path)[1].lower() not in EXTENSIONS:
+        return False
+    try:
+        return faststart(path)
+    except (MP4Error, struct.error, IOError) as e:
+        app.logger.warning("mp4 faststart failed for %s: %s", path, e)
+        return False
+
+
+def read_meta(path):
+    """
+    返回 MP4 文件的元数据，不是 MP4 或解析失败时返回 None
+    """
+    if os.path.splitext(path)[1].lower() not in EXTENSIONS:
+        return None
+    try:
+        return probe(path)
+    except (MP4Error, struct.error, IOError) as e:
+        app.logger.warning("mp4 probe failed for %s: %s", path, e)
+        return None
+
+
+def process(path):
+    """
+    对不按内容保存的文件原地做 faststart 改写并返回元数据
+    """
+    prepare(path)
+    return read_meta(path)
@@ -0,0 +1,156 @@
+import math
+from datetime import date, datetime
+
+from flask_sqlalchemy import Pagination
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import and_, or_, func
+
+from app import app, facets
+from app.models import Movie
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午3:20"
+
+# 首页排序参数 -> (排序列, 取值函数)，顺序与原来 order_by 的叠加顺序一致
+# NULL 统一折算成最小值，和 MySQL 中 NULL 排在最前的行为保持一致
+MIN_DATE = date(1970, 1, 1)
+SORT_KEYS = (
+    ("time", func.coalesce(Movie.release_time, MIN_DATE), lambda m: m.release_time or MIN_DATE),
+    ("pm", func.coalesce(Movie.play_num, 0), lambda m: m.play_num or 0),
+    ("cm", func.coalesce(Movie.comment_num, 0), lambda m: m.comment_num or 0),
+)
+
+serializer = URLSafeSerializer(app.config["SECRET_KEY"], salt="movie-cursor")
+
+
+class KeysetPagination(Pagination):
+    """
+    游标分页结果，接口与 Pagination 一致，额外带上前后页游标
+    """
+
+    def __init__(self, page, per_page, total, items, has_prev, has_next, prev_cursor=None, next_cursor=None):
+        Pagination.__init__(self, None, page, per_page, total, items)
+        self._has_prev = has_prev
+        self._has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def pages(self):
+        # 总数是近似值，保证当前页和下一页始终在页码范围内
+        pages = int(math.ceil(self.total / float(self.per_page))) if self.total else 0
+        return max(pages, self.page + 1 if self._has_next else self.page)
+
+    @property
+    def has_prev(self):
+        return self._has_prev
+
+    @property
+    def has_next(self):
+        return self._has_next
+
+
+def sort_spec(p):
+    """
+    根据首页参数生成排序规格 [(参数名, 排序列, 取值函数, 是否降序)]，最后以 id 升序兜底保证顺序稳定
+    """
+    spec = []
+    for name, column, getter in SORT_KEYS:
+        value = int(p[name])
+        if value != 0:
+            spec.append((name, column, getter, value == 1))
+    spec.append(("id", Movie.id, lambda m: m.id, False))
+    return spec
+
+
+def encode_cursor(p, spec, movie, page):
+    values = []
+    for name, column, getter, desc in spec:
+        value = getter(movie)
+        if isinstance(value, date):
+            value = value.strftime("%Y-%m-%d")
+        values.append(value)
+    return serializer.dumps(dict(f=_fingerprint(p), k=values, p=page))
+
+
+def decode_cursor(p, spec, token):
+    """
+    解析游标，返回 (排序键值, 页码)；游标无效或与当前筛选条件不符时返回 None
+    """
+    try:
+        data = serializer.loads(token)
+    except BadSignature:
+        return None
+    if data.get("f") != _fingerprint(p) or len(data.get("k", [])) != len(spec):
+        return None
+    values = []
+    for (name, column, getter, desc), value in zip(spec, data["k"]):
+        if name == "time":
+            value = datetime.strptime(value, "%Y-%m-%d").date()
+        values.append(value)
+    return values, int(data["p"])
+
+
+def seek(spec, values, backward=False):
+    """
+    生成 (k1, k2, ..., id) 越过游标位置的条件，支持每列方向不同
+    """
+    clauses = []
+    for i, (name, column, getter, desc) in enumerate(spec):
+        cond = column < values[i] if desc != backward else column > values[i]
+        eqs = [spec[j][1] == values[j] for j in range(i)]
+        clauses.append(and_(*(eqs + [cond])))
+    return or_(*clauses)
+
+
+def order(spec, backward=False):
+    return [
+        column.desc() if desc != backward else column.asc()
+        for name, column, getter, desc in spec
+    ]
+
+
+def approx_total(p):
+    """
+    总数取自 Redis 中的标签/星级计数，避免每次翻页都执行 COUNT(*)
+    """
+    return facets.total(int(p["tid"]), int(p["star"]))
+
+
+def paginate(query, p, page=1, per_page=8, after=None, before=None):
+    """
+    首页游标分页：带 after/before 游标时按排序键定位，否则按页码偏移（仅直接跳页时使用）
+    """
+    spec = sort_spec(p)
+    total = approx_total(p)
+    cursor = decode_cursor(p, spec, after or before) if (after or before) else None
+
+    if cursor and before:
+        values, cur_page = cursor
+        rows = query.filter(seek(spec, values, backward=True)).order_by(
+            *order(spec, backward=True)
+        ).limit(per_page + 1).all()
+        items = rows[:per_page][::-1]
+        page = max(cur_page - 1, 1)
+        has_prev = len(rows) > per_page
+        has_next = True
+    else:
+        if cursor:
+            values, cur_page = cursor
+            query = query.filter(seek(spec, values))
+            page = cur_page + 1
+        query = query.order_by(*order(spec))
+        if not cursor and page > 1:
+            query = query.offset((page - 1) * per_page)
+        rows = query.limit(per_page + 1).all()
+        items = rows[:per_page]
+        has_prev = page > 1
+        has_next = len(rows) > per_page
+
+    prev_cursor = encode_cursor(p, spec, items[0], page) if items and has_prev else None
+    next_cursor = encode_cursor(p, spec, items[-1], page) if items and has_next else None
+    return KeysetPagination(page, per_page, total, items, has_prev, has_next, prev_cursor, next_cursor)
+
+
+def _fingerprint(p):
+    return [int(p[name]) for name in ("tid", "star", "time", "pm", "cm")]
@@ -0,0 +1,175 @@
+import threading
+import time
+from datetime import date
+
+from flask_sqlalchemy import Pagination
+from sqlalchemy import and_, or_
+
+from app import app, db, cache
+from app.models import Movie
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，未安装时首页回退到数据库分页
+    np = None
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午4:40"
+
+MIN_ORDINAL = date(1970, 1, 1).toordinal()
+
+# 列名 -> numpy 类型，NULL 按 MySQL 排序规则折算成最小值
+COLUMNS = (
+    ("id", "int64"),
+    ("tag_id", "int32"),
+    ("star", "int16"),
+    ("play_num", "int64"),
+    ("comment_num", "int64"),
+    ("release_time", "int32"),
+)
+
+# 首页排序参数 -> 列名，顺序与原来 order_by 的叠加顺序一致
+SORT_COLUMNS = (("time", "release_time"), ("pm", "play_num"), ("cm", "comment_num"))
+
+
+class CatalogSnapshot(object):
+    """
+    电影表的内存列式快照，首页的筛选、排序、分页在 numpy 中一次完成，只回表读取当前页的 8 行
+    """
+
+    def __init__(self, interval=5, full_interval=600):
+        self.interval = interval
+        self.full_interval = full_interval
+        self.arrays = None
+        self.watermark = None
+        self.version = 0
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def ready(self):
+        return self.arrays is not None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="catalog-snapshot")
+                self.thread.daemon = True
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    self.refresh()
+                    db.session.remove()
+            except Exception:
+                app.logger.exception("catalog snapshot refresh failed")
+            time.sleep(self.interval)
+
+    def refresh(self):
+        """
+        按 (add_time, id) 水位线增量加载新电影，按变更记录重载修改过的电影；
+        播放量、评论量的变化靠定期全量重载同步
+        """
+        version, changed = cache.catalog_changes(self.version)
+        if self.arrays is None or changed is None or time.time() - self.loaded_at > self.full_interval:
+            rows = self._query().all()
+            self.watermark = None
+            self._advance(rows)
+            self.arrays = self._build(rows)
+            self.loaded_at = time.time()
+        else:
+            query = self._query()
+            if self.watermark is not None:
+                add_time, mid = self.watermark
+                query = query.filter(or_(
+                    Movie.add_time > add_time,
+                    and_(Movie.add_time == add_time, Movie.id > mid)
+                ))
+            rows = query.all()
+            if changed:
+                rows += self._query().filter(Movie.id.in_(changed)).all()
+            if rows or changed:
+                rows = list(dict((row.id, row) for row in rows).values())
+                self._advance(rows)
+                self.arrays = self._merge(self.arrays, changed, rows)
+        self.version = version
+
+    def _query(self):
+        return db.session.query(
+            Movie.id, Movie.tag_id, Movie.star, Movie.play_num,
+            Movie.comment_num, Movie.release_time, Movie.add_time
+        ).order_by(Movie.add_time.asc(), Movie.id.asc())
+
+    def _advance(self, rows):
+        for row in rows:
+            if row.add_time is not None:
+                mark = (row.add_time, row.id)
+                if self.watermark is None or mark > self.watermark:
+                    self.watermark = mark
+
+    def _build(self, rows):
+        data = dict((name, []) for name, dtype in COLUMNS)
+        for row in rows:
+            data["id"].append(row.id)
+            data["tag_id"].append(row.tag_id or 0)
+            data["star"].append(row.star or 0)
+            data["play_num"].append(row.play_num or 0)
+            data["comment_num"].append(row.comment_num or 0)
+            data["release_time"].append(row.release_time.toordinal() if row.release_time else MIN_ORDINAL)
+        return dict((name, np.array(data[name], dtype=dtype)) for name, dtype in COLUMNS)
+
+    def _merge(self, arrays, changed, rows):
+        # 去掉修改/删除过的行以及重复加载的行，再追加新读到的行
+        drop = set(changed or ())
+        drop.update(row.id for row in rows)
+        keep = ~np.isin(arrays["id"], np.array(sorted(drop), dtype="int64"))
+        fresh = self._build(rows)
+        return dict(
+            (name, np.concatenate([arrays[name][keep], fresh[name]]))
+            for name, dtype in COLUMNS
+        )
+
+    def select(self, p, page, per_page):
+        """
+        返回 (当前页电影 id 列表, 总数)
+        """
+        arrays = self.arrays
+        mask = np.ones(len(arrays["id"]), dtype=bool)
+        if int(p["tid"]) != 0:
+            mask &= arrays["tag_id"] == int(p["tid"])
+        if int(p["star"]) != 0:
+            mask &= arrays["star"] == int(p["star"])
+        idx = np.flatnonzero(mask)
+
+        # np.lexsort 以最后一个键为主键，降序通过取负实现，最后用 id 升序兜底
+        keys = [arrays["id"][idx]]
+        for name, column in reversed(SORT_COLUMNS):
+            value = int(p[name])
+            if value != 0:
+                col = arrays[column][idx]
+                keys.append(-col if value == 1 else col)
+        start = (page - 1) * per_page
+        order = np.lexsort(keys)[start:start + per_page]
+        return [int(v) for v in arrays["id"][idx[order]]], len(idx)
+
+    def paginate(self, p, page=1, per_page=8):
+        ids, total = self.select(p, page, per_page)
+        movies = dict((m.id, m) for m in Movie.query.filter(Movie.id.in_(ids)).all()) if ids else {}
+        items = [movies[v] for v in ids if v in movies]
+        return Pagination(None, page, per_page, total, items)
+
+
+snapshot = CatalogSnapshot()
+
+
+def get_snapshot():
+    """
+    返回已加载的快照；未启用、未安装 numpy 或首次加载尚未完成时返回 None
+    """
+    if np is None or not app.config.get("CATALOG_SNAPSHOT"):
+        return None
+    snapshot.start()
+    return snapshot if snapshot.ready else None
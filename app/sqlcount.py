@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+
+from flask import url_for
+from sqlalchemy import event
+
+from app import app, db
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午8:40"
+
+# 各列表页应执行的 SQL 条数：分页 COUNT + 当前页查询（关联对象已随 JOIN 加载）
+# flask_sqlalchemy 在第一页不满时会省略 COUNT，所以检查时需要每个列表至少有一整页数据
+EXPECTED_QUERIES = (
+    ("admin.comment_list", 2),
+    ("admin.moviecol_list", 2),
+    ("admin.oplog_list", 2),
+    ("admin.adminloginlog_list", 2),
+    ("admin.userloginlog_list", 2),
+    ("admin.admin_list", 2),
+    ("admin.movie_list", 2),
+    ("home.comments", 2),
+    ("home.moviecol", 2),
+)
+
+
+@contextmanager
+def count_queries():
+    """
+    记录代码块内执行的全部 SQL 语句：
+
+        with count_queries() as statements:
+            ...
+        len(statements)
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.get_engine(app)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@contextmanager
+def assert_num_queries(num):
+    with count_queries() as statements:
+        yield statements
+    if len(statements) != num:
+        raise AssertionError("expected %d SQL statements, got %d:\n%s" % (
+            num, len(statements), "\n".join(statements)
+        ))
+
+
+def check_views(admin_id, user_id):
+    """
+    以指定的管理员、会员身份请求 EXPECTED_QUERIES 中的页面，返回不符合预期的 [(页面, 预期, 实际语句)]
+    """
+    failures = []
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["admin"] = "check"
+        sess["admin_id"] = admin_id
+        sess["user"] = "check"
+        sess["user_id"] = user_id
+    for endpoint, num in EXPECTED_QUERIES:
+        with app.test_request_context():
+            url = url_for(endpoint, page=1)
+        with count_queries() as statements:
+            client.get(url)
+        if len(statements) != num:
+            failures.append((endpoint, num, list(statements)))
+    return failures
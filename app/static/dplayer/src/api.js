@@ -2,15 +2,19 @@
  * xhr.status ---> fail
  * response.code === 1 ---> success
  * response.code !== 1 ---> error
+ * xhr.status === 304 ---> success with the cached response
  * */
 
-const SendXMLHttpRequest = (url, data, success, error, fail) => {
+// endpoint -> { etag, response } of the last successful read
+const readCache = {};
+
+const SendXMLHttpRequest = (url, data, success, error, fail, cached) => {
     const xhr = new XMLHttpRequest();
 
     xhr.onreadystatechange = () => {
         if (xhr.readyState === 4) {
             if (xhr.status >= 200 && xhr.status < 300 || xhr.status === 304) {
-                const response = JSON.parse(xhr.responseText);
+                const response = xhr.status === 304 && cached ? cached.response : JSON.parse(xhr.responseText);
 
                 if (response.code !== 1) {
                     return error(xhr, response);
@@ -24,6 +28,9 @@ const SendXMLHttpRequest = (url, data, success, error, fail) => {
     };
 
     xhr.open(data !== null ? 'POST' : 'GET', url, true);
+    if (cached) {
+        xhr.setRequestHeader('If-None-Match', cached.etag);
+    }
     xhr.send(data !== null ? JSON.stringify(data) : null);
 };
 
@@ -40,11 +47,15 @@ module.exports = {
 
     read: (endpoint, cbk) => {
         SendXMLHttpRequest(endpoint, null, (xhr, response) => {
+            const etag = xhr.getResponseHeader('ETag');
+            if (etag) {
+                readCache[endpoint] = { etag, response };
+            }
             cbk(null, response.danmaku);
         }, (xhr, response) => {
             cbk({ status: xhr.status, response });
         }, (xhr) => {
             cbk({ status: xhr.status, response: null });
-        });
+        }, readCache[endpoint]);
     }
 };
\ No newline at end of file
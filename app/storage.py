@@ -0,0 +1,256 @@
+import hashlib
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+from werkzeug.utils import secure_filename
+
+from app import app, rd, thumbs
+
+__author__ = "TuDi"
+__date__ = "2026/10/19 上午3:20"
+
+# 按内容寻址保存上传文件：文件名为内容的 SHA-256，存放在 ab/cd/<hash>.<扩展名>，
+# 内容相同的文件只保存一份，Redis 中记录每个文件被引用的次数，引用数归零时删除文件。
+# 保存的文件名仍是相对 UP_DIR（头像为 UP_DIR/users/）的路径，模板和 /media/ 不需要改动
+REFS_KEY = "storage:refs"
+LOCK_KEY = "storage:lock:{0}"
+LOCK_TIMEOUT = 60
+TMP_DIR = ".tmp"
+READ_SIZE = 1024 * 1024
+
+# 头像单独放在 users/ 下
+USERS = "users/"
+
+NAME_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[0-9a-z]+)?$")
+
+# 锁的值为加锁时生成的随机串，只有持有者才能删除，锁过期后被别人拿到也不会误删
+UNLOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+_unlock = rd.register_script(UNLOCK_SCRIPT)
+
+
+class LockTimeout(RuntimeError):
+    """
+    等待 LOCK_TIMEOUT 秒仍未拿到同一内容的锁
+    """
+
+
+def is_addressed(name):
+    # 迁移前的文件名（时间戳 + uuid）不参与引用计数
+    return bool(name and NAME_RE.match(name))
+
+
+def path(name, folder=""):
+    return os.path.join(app.config["UP_DIR"], folder, name)
+
+
+def temp_path(filename=""):
+    """
+    返回上传目录下的临时文件路径（保留扩展名），与最终位置在同一文件系统，保存时直接 rename
+    """
+    directory = os.path.join(app.config["UP_DIR"], TMP_DIR)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    return os.path.join(directory, uuid.uuid4().hex + _extension(filename))
+
+
+def _extension(filename):
+    ext = os.path.splitext(secure_filename(filename or ""))[1].lower()
+    return ext if re.match(r"^\.[0-9a-z]+$", ext) else ""
+
+
+def _name(digest, filename):
+    return "%s/%s/%s%s" % (digest[:2], digest[2:4], digest, _extension(filename))
+
+
+def hash_file(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            sha.update(data)
+    return sha.hexdigest()
+
+
+@contextmanager
+def _locked(digest):
+    # 同一内容的保存和释放互斥，避免释放删除文件的同时另一个请求增加了引用
+    key = LOCK_KEY.format(digest)
+    token = uuid.uuid4().hex
+    deadline = time.time() + LOCK_TIMEOUT
+    while not rd.set(key, token, nx=True, ex=LOCK_TIMEOUT):
+        if time.time() > deadline:
+            raise LockTimeout("storage lock busy: %s" % digest)
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        _unlock(keys=[key], args=[token])
+
+
+def store(tmp, filename, folder="", digest=None, process=None):
+    """
+    把临时文件 tmp 移入内容寻址的位置并增加引用，返回保存的文件名；内容已存在时删除 tmp。
+    process(tmp, filename) 在计算哈希前调用（如 MP4 faststart），返回 True 表示改写了文件、需要重新计算哈希
+    """
+    try:
+        if process is not None and process(tmp, filename):
+            digest = None
+        if digest is None:
+            digest = hash_file(tmp)
+        name = _name(digest, filename)
+        target = path(name, folder)
+        with _locked(digest):
+            if os.path.exists(target):
+                os.remove(tmp)
+            else:
+                if not os.path.exists(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                os.rename(tmp, target)
+            rd.hincrby(REFS_KEY, folder + name, 1)
+        return name
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def save(stream, filename, folder="", process=None):
+    """
+    把上传的文件流写入临时文件，边写边计算 SHA-256，然后按内容保存；返回保存的文件名
+    """
+    tmp = temp_path(filename)
+    sha = hashlib.sha256()
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                sha.update(data)
+                f.write(data)
+    except Exception:
+        os.remove(tmp)
+        raise
+    return store(tmp, filename, folder, sha.hexdigest(), process)
+
+
+def release(name, folder=""):
+    """
+    减少一次引用，没有引用时删除文件；返回是否删除了文件
+    """
+    if not is_addressed(name):
+        return False
+    digest = NAME_RE.match(name).group(1)
+    with _locked(digest):
+        if rd.hincrby(REFS_KEY, folder + name, -1) > 0:
+            return False
+        rd.hdel(REFS_KEY, folder + name)
+        try:
+            os.remove(path(name, folder))
+        except OSError:
+            return False
+    thumbs.remove(name, folder)
+    for directory in (os.path.dirname(path(name, folder)), os.path.dirname(os.path.dirname(path(name, folder)))):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+    return True
+
+
+def rewrite(name, process, folder=""):
+    """
+    对已保存的文件做 process 改写：在副本上改写后按新内容保存并释放原文件，
+    不改动原文件（可能被其他记录引用）；返回新的文件名，未改写时返回原文件名
+    """
+    tmp = temp_path(name)
+    shutil.copyfile(path(name, folder), tmp)
+    try:
+        if not process(tmp, name):
+            return name
+        new = store(tmp, name, folder)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    release(name, folder)
+    return new
+
+
+def references():
+    """
+    从数据库统计每个文件被引用的次数：{相对 UP_DIR 的路径: 次数}
+    """
+    from app.models import Movie, Preview, User
+    counts = {}
+    rows = [(url, "") for url, in Movie.query.with_entities(Movie.url)]
+    rows += [(logo, "") for logo, in Movie.query.with_entities(Movie.logo)]
+    rows += [(logo, "") for logo, in Preview.query.with_entities(Preview.logo)]
+    rows += [(face, USERS) for face, in User.query.with_entities(User.face)]
+    for name, folder in rows:
+        if is_addressed(name):
+            counts[folder + name] = counts.get(folder + name, 0) + 1
+    return counts
+
+
+def iter_files(folder=""):
+    # 逐个返回 folder 下按内容保存的文件名
+    root = path("", folder)
+    for first in sorted(os.listdir(root)) if os.path.isdir(root) else ():
+        if not re.match(r"^[0-9a-f]{2}$", first):
+            continue
+        for second in sorted(os.listdir(os.path.join(root, first))):
+            directory = os.path.join(root, first, second)
+            if not os.path.isdir(directory):
+                continue
+            for filename in sorted(os.listdir(directory)):
+                name = "%s/%s/%s" % (first, second, filename)
+                if is_addressed(name):
+                    yield name
+
+
+def reconcile(remove_orphans=False, min_age=24 * 3600):
+    """
+    按数据库重新计算引用数；remove_orphans 时删除没有引用、且超过 min_age 秒的文件
+    （刚完成分块上传、还未提交表单的文件没有引用）。返回 (文件数, 没有引用的文件数)
+    """
+    counts = references()
+    pipe = rd.pipeline()
+    pipe.delete(REFS_KEY)
+    if counts:
+        pipe.hmset(REFS_KEY, counts)
+    pipe.execute()
+    orphans = 0
+    now = time.time()
+    for folder in ("", USERS):
+        for name in iter_files(folder):
+            if folder + name in counts:
+                continue
+            orphans += 1
+            if remove_orphans and now - os.path.getmtime(path(name, folder)) > min_age:
+                os.remove(path(name, folder))
+    return len(counts), orphans
+
+
+def migrate(name, folder=""):
+    """
+    把迁移前的上传文件按内容保存一份，返回新的文件名；文件不存在或已迁移时返回原文件名。
+    原文件保留，由调用方在数据库提交后删除
+    """
+    if not name or is_addressed(name) or not os.path.isfile(path(name, folder)):
+        return name
+    tmp = temp_path(name)
+    try:
+        os.link(path(name, folder), tmp)
+    except OSError:
+        shutil.copyfile(path(name, folder), tmp)
+    return store(tmp, name, folder)
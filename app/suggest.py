@@ -0,0 +1,168 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from app import app, db, cache
+from app.models import Movie
+
+__author__ = "TuDi"
+__date__ = "2026/10/18 下午6:50"
+
+# 检查片库变更的间隔（秒）；播放量变化不会记录变更，由后台线程定期全量重建同步
+CHECK_INTERVAL = 5
+FULL_INTERVAL = 600
+
+# 长度不超过该值的前缀预先算好热门结果，避免单字前缀扫描大段区间
+PRECOMPUTE_LEN = 2
+
+TOP_K = 10
+
+
+def normalize(title):
+    return (title or "").strip().lower()
+
+
+class PrefixIndex(object):
+    """
+    按标题排序的数组，前缀查询用二分定位区间，区间内按播放量取前 K 个
+    """
+
+    def __init__(self, rows=()):
+        entries = sorted((normalize(title), -(play_num or 0), mid, title) for mid, title, play_num in rows)
+        self.keys = [e[0] for e in entries]
+        self.entries = entries
+        self.top = {}
+        for key in set(k[:n] for k in self.keys for n in range(1, PRECOMPUTE_LEN + 1)):
+            self.top[key] = self._scan(key)
+
+    def _range(self, prefix):
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + u"\U0010ffff", lo)
+        return lo, hi
+
+    def _scan(self, prefix, k=TOP_K):
+        lo, hi = self._range(prefix)
+        best = heapq.nsmallest(k, (e[1:] for e in self.entries[lo:hi]))
+        return [(mid, title) for play_num, mid, title in best]
+
+    def suggest(self, prefix, k=TOP_K):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= PRECOMPUTE_LEN:
+            return self.top.get(prefix, [])[:k]
+        return self._scan(prefix, k)
+
+    def update(self, removed, rows):
+        """
+        删除 removed 中的电影后插入 rows，只重算受影响前缀的预计算结果
+        """
+        touched = set()
+        if removed:
+            keep = []
+            for e in self.entries:
+                if e[2] in removed:
+                    touched.add(e[0])
+                else:
+                    keep.append(e)
+            self.entries = keep
+        for mid, title, play_num in rows:
+            entry = (normalize(title), -(play_num or 0), mid, title)
+            self.entries.insert(bisect_left(self.entries, entry), entry)
+            touched.add(entry[0])
+        self.keys = [e[0] for e in self.entries]
+        for key in set(k[:n] for k in touched for n in range(1, PRECOMPUTE_LEN + 1) if k[:n]):
+            result = self._scan(key)
+            if result:
+                self.top[key] = result
+            else:
+                self.top.pop(key, None)
+
+
+class Suggester(object):
+    """
+    请求中只做增量更新；定期全量重建（同步播放量）在后台线程中执行，不占用输入联想请求的时间
+    """
+
+    def __init__(self):
+        self.index = None
+        self.version = 0
+        self.checked_at = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="suggest-rebuild")
+                self.thread.daemon = True
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            # 每 FULL_INTERVAL 秒重建一次，变更记录被截断时由请求提前唤醒
+            self.wake.wait(FULL_INTERVAL)
+            self.wake.clear()
+            try:
+                with app.app_context():
+                    self.rebuild()
+                    db.session.remove()
+            except Exception:
+                app.logger.exception("suggest index rebuild failed")
+
+    def _rows(self, ids=None):
+        query = db.session.query(Movie.id, Movie.title, Movie.play_num)
+        if ids is not None:
+            query = query.filter(Movie.id.in_(ids))
+        return query.all()
+
+    def rebuild(self):
+        # 先取版本号再读数据，期间的变更会在下次检查时再应用一次
+        version = cache.catalog_version()
+        index = PrefixIndex(self._rows())
+        with self.lock:
+            self.index = index
+            self.version = version
+
+    def get_index(self):
+        now = time.time()
+        if self.index is not None and now - self.checked_at <= CHECK_INTERVAL:
+            return self.index
+        self.start()
+        with self.lock:
+            if self.index is None:
+                # 首次使用时同步加载
+                version = cache.catalog_version()
+                self.index = PrefixIndex(self._rows())
+                self.version = version
+                self.checked_at = now
+            elif now - self.checked_at > CHECK_INTERVAL:
+                version, changed = cache.catalog_changes(self.version)
+                if changed is None:
+                    # 变更记录已被截断，先继续使用旧索引，交给后台线程全量重建
+                    self.wake.set()
+                elif changed:
+                    # 在副本上增量修改后整体替换，读者始终看到完整的索引
+                    index = PrefixIndex()
+                    index.entries = list(self.index.entries)
+                    index.keys = list(self.index.keys)
+                    index.top = dict(self.index.top)
+                    index.update(changed, self._rows(changed))
+                    self.index = index
+                    self.version = version
+                else:
+                    self.version = version
+                self.checked_at = now
+        return self.index
+
+
+suggester = Suggester()
+
+
+def suggest(prefix, k=TOP_K):
+    """
+    返回 [(电影id, 标题)]，按播放量从高到低
+    """
+    return suggester.get_index().suggest(prefix, k)
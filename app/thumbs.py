@@ -0,0 +1,219 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import url_for
+from jinja2 import Markup, escape
+
+from app import app
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 为可选依赖，未安装时页面直接使用原图
+    Image = None
+
+__author__ = "TuDi"
+__date__ = "2026/10/19 上午4:10"
+
+# 封面、头像的缩略图：上传时在进程池中按预设尺寸生成 WebP 和 JPEG，页面用 srcset 让浏览器按显示宽度选择；
+# 缺少的缩略图在第一次请求时生成。缩略图保存在 UP_DIR/thumbs/<预设>/<宽度>/<原文件名>.<格式>，
+# 原文件按内容命名，内容不变时缩略图不会过期
+THUMB_DIR = "thumbs/"
+
+# 预设：宽度（包含 2 倍屏）、高宽比（None 为保持原比例，否则居中裁剪）、默认的 sizes
+PRESETS = dict(
+    poster=dict(widths=(131, 262, 524), ratio=None, sizes="262px"),
+    preview=dict(widths=(480, 960), ratio=None, sizes="480px"),
+    avatar=dict(widths=(50, 100), ratio=1.0, sizes="50px"),
+)
+
+# 扩展名 -> (Pillow 格式, MIME)，先列出的格式优先
+FORMATS = (
+    ("webp", "WEBP", "image/webp"),
+    ("jpg", "JPEG", "image/jpeg"),
+)
+QUALITY = 80
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
+
+# 未在 app.config 中配置 THUMB_WORKERS 时的进程数
+WORKERS = 2
+# 请求时生成缩略图最多等待的秒数
+RENDER_TIMEOUT = 10
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def enabled(name):
+    return Image is not None and bool(name) and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def relpath(name, preset, width, ext, folder=""):
+    # 相对 UP_DIR 的缩略图路径
+    return "%s%s/%d/%s%s.%s" % (THUMB_DIR, preset, width, folder, name, ext)
+
+
+def parse(filename):
+    """
+    把缩略图路径（不含 thumbs/）解析为 (预设, 宽度, 原文件相对 UP_DIR 的路径, 扩展名)，不合法时返回 None
+    """
+    parts = filename.split("/", 2)
+    if len(parts) != 3 or parts[0] not in PRESETS or not parts[1].isdigit():
+        return None
+    preset, width, rest = parts[0], int(parts[1]), parts[2]
+    source, ext = os.path.splitext(rest)
+    ext = ext[1:]
+    if width not in PRESETS[preset]["widths"] or ext not in [f[0] for f in FORMATS] or not enabled(source):
+        return None
+    return preset, width, source, ext
+
+
+def _resize(image, width, ratio):
+    w, h = image.size
+    if ratio:
+        # 居中裁剪到目标比例
+        if h > w * ratio:
+            nh = int(round(w * ratio))
+            top = (h - nh) // 2
+            image = image.crop((0, top, w, top + nh))
+        else:
+            nw = int(round(h / ratio))
+            left = (w - nw) // 2
+            image = image.crop((left, 0, left + nw, h))
+        w, h = image.size
+    if w > width:
+        # 不放大比目标小的图片
+        image = image.resize((width, max(1, int(round(h * width / float(w))))), Image.LANCZOS)
+    return image
+
+
+def _render(src, jobs):
+    """
+    在进程池中执行：打开一次原图，生成 jobs 中的每个 (目标路径, 宽度, 高宽比, Pillow 格式)；返回生成的个数
+    """
+    image = Image.open(src)
+    if hasattr(ImageOps, "exif_transpose"):
+        # 按 EXIF 方向旋转手机拍摄的照片
+        image = ImageOps.exif_transpose(image)
+    image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+    for dst, width, ratio, kind in jobs:
+        out = _resize(image, width, ratio)
+        if kind == "JPEG" and out.mode == "RGBA":
+            # JPEG 不支持透明，铺白色背景
+            background = Image.new("RGB", out.size, (255, 255, 255))
+            background.paste(out, mask=out.split()[3])
+            out = background
+        directory = os.path.dirname(dst)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        # 先写临时文件再改名，同时请求同一缩略图时不会读到写了一半的文件
+        tmp = "%s.%s.tmp" % (dst, uuid.uuid4().hex)
+        try:
+            out.save(tmp, kind, quality=QUALITY)
+            os.rename(tmp, dst)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return len(jobs)
+
+
+def get_pool():
+    # 第一次使用时创建，避免在 fork 出工作进程之前启动
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=app.config.get("THUMB_WORKERS", WORKERS))
+    return _pool
+
+
+def _jobs(name, preset, folder, variants=None):
+    jobs = []
+    conf = PRESETS[preset]
+    for width, ext in variants or [(w, f[0]) for w in conf["widths"] for f in FORMATS]:
+        dst = os.path.join(app.config["UP_DIR"], relpath(name, preset, width, ext, folder))
+        if not os.path.exists(dst):
+            kind = [f[1] for f in FORMATS if f[0] == ext][0]
+            jobs.append((dst, width, conf["ratio"], kind))
+    return jobs
+
+
+def generate(name, preset, folder="", wait=False):
+    """
+    上传后调用：在进程池中生成 name 缺少的全部缩略图，默认不等待结果；返回 Future，不是图片时返回 None
+    """
+    if not enabled(name):
+        return None
+    jobs = _jobs(name, preset, folder)
+    if not jobs:
+        return None
+    future = get_pool().submit(_render, os.path.join(app.config["UP_DIR"], folder, name), jobs)
+    if wait:
+        future.result()
+    return future
+
+
+def render(preset, width, source, ext):
+    """
+    请求时生成一张缺少的缩略图，返回缩略图的绝对路径；原图不存在或生成失败时返回 None
+    """
+    src = os.path.join(app.config["UP_DIR"], source)
+    if not os.path.isfile(src):
+        return None
+    dst = os.path.join(app.config["UP_DIR"], relpath(source, preset, width, ext))
+    if os.path.exists(dst):
+        return dst
+    conf = PRESETS[preset]
+    kind = [f[1] for f in FORMATS if f[0] == ext][0]
+    try:
+        get_pool().submit(_render, src, [(dst, width, conf["ratio"], kind)]).result(RENDER_TIMEOUT)
+    except Exception as e:
+        app.logger.warning("thumbnail failed for %s: %s", source, e)
+        return None
+    return dst
+
+
+def remove(name, folder=""):
+    """
+    原文件删除后调用，删除它的全部缩略图
+    """
+    for preset, conf in PRESETS.items():
+        for width in conf["widths"]:
+            for ext, _, _ in FORMATS:
+                path = os.path.join(app.config["UP_DIR"], relpath(name, preset, width, ext, folder))
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def srcset(name, preset, ext, folder=""):
+    # "url 131w, url 262w, ..." 形式的 srcset
+    return ", ".join(
+        "%s %dw" % (url_for("home.thumb", filename=relpath(name, preset, width, ext, folder)[len(THUMB_DIR):]), width)
+        for width in PRESETS[preset]["widths"]
+    )
+
+
+@app.template_global()
+def picture(name, preset, folder="", sizes=None, **attrs):
+    """
+    模板中使用：{{ picture(movie.logo, "poster", class="img-responsive", style="width: 262px") }}，
+    输出带 WebP/JPEG srcset 的 <picture>；未安装 Pillow 或不是图片时输出原图的 <img>
+    """
+    attrs.setdefault("alt", "")
+    original = url_for("static", filename="uploads/" + folder + name)
+    img = "<img src=\"%s\"%s>" % (escape(original), "".join(
+        " %s=\"%s\"" % (key.rstrip("_"), escape(value)) for key, value in sorted(attrs.items())
+    ))
+    if not enabled(name):
+        return Markup(img)
+    sizes = sizes or PRESETS[preset]["sizes"]
+    sources = "".join(
+        "<source type=\"%s\" srcset=\"%s\" sizes=\"%s\">" % (mime, escape(srcset(name, preset, ext, folder)), escape(sizes))
+        for ext, _, mime in FORMATS
+    )
+    return Markup("<picture>%s%s</picture>" % (sources, img))
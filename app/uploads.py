@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from app import app, rd
+
+__author__ = "TuDi"
+__date__ = "2026/10/19 上午2:40"
+
+# 分块上传：init 建立上传 -> 按 offset 依次 PUT 分块（附带 SHA-256）-> finalize 按内容保存到上传目录。
+# 上传状态存在 Redis，分块直接写入 UP_DIR/.partial/ 下的临时文件，中断后按 offset 继续
+STATE_KEY = "upload:{0}"
+LOCK_KEY = "upload:{0}:lock"
+STATE_TIMEOUT = 24 * 3600
+PARTIAL_DIR = ".partial"
+
+# 建议的分块大小和允许的最大分块
+CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+FIELDS = ("url", "logo")
+MAX_SIZES = dict(url=20 * 1024 ** 3, logo=20 * 1024 ** 2)
+
+
+class UploadError(Exception):
+    def __init__(self, msg, status=400, offset=None):
+        super(UploadError, self).__init__(msg)
+        self.msg = msg
+        self.status = status
+        self.offset = offset
+
+
+def _partial_path(upload_id):
+    return os.path.join(app.config["UP_DIR"], PARTIAL_DIR, upload_id)
+
+
+def _load(upload_id, admin_id):
+    data = rd.get(STATE_KEY.format(upload_id))
+    if data is None:
+        raise UploadError("上传不存在或已过期", 404)
+    state = json.loads(data.decode("utf8"))
+    if state["admin_id"] != admin_id:
+        raise UploadError("上传不存在或已过期", 404)
+    return state
+
+
+def _save(upload_id, state):
+    rd.setex(STATE_KEY.format(upload_id), STATE_TIMEOUT, json.dumps(state))
+
+
+def init(admin_id, filename, size, field):
+    """
+    建立一个上传，返回上传状态
+    """
+    if field not in FIELDS:
+        raise UploadError("不支持的字段")
+    size = int(size)
+    if size <= 0 or size > MAX_SIZES[field]:
+        raise UploadError("文件大小不符合要求")
+    upload_id = uuid.uuid4().hex
+    path = _partial_path(upload_id)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, "wb").close()
+    state = dict(
+        id=upload_id,
+        admin_id=admin_id,
+        filename=filename,
+        field=field,
+        size=size,
+        offset=0,
+        done=None,
+        created=int(time.time())
+    )
+    _save(upload_id, state)
+    return dict(state, chunk_size=CHUNK_SIZE)
+
+
+def status(upload_id, admin_id):
+    return _load(upload_id, admin_id)
+
+
+def write_chunk(upload_id, admin_id, offset, stream, length, checksum=None):
+    """
+    把请求体中的分块写到临时文件的 offset 处，边写边计算 SHA-256 并与 checksum 比较（必须提供）；
+    offset 与已接收的字节数不一致时返回 409 和正确的 offset，校验失败时丢弃这一块。返回新的 offset
+    """
+    if not checksum:
+        raise UploadError("缺少分块校验值", 400, offset)
+    if not rd.set(LOCK_KEY.format(upload_id), 1, nx=True, ex=300):
+        raise UploadError("该分块正在上传", 409)
+    try:
+        state = _load(upload_id, admin_id)
+        if state["done"]:
+            raise UploadError("上传已完成", 409, state["offset"])
+        if offset != state["offset"]:
+            raise UploadError("offset 不正确", 409, state["offset"])
+        if length is None or length <= 0 or length > MAX_CHUNK_SIZE or offset + length > state["size"]:
+            raise UploadError("分块大小不符合要求", 413, state["offset"])
+        sha = hashlib.sha256()
+        received = 0
+        with open(_partial_path(upload_id), "r+b") as f:
+            f.seek(offset)
+            try:
+                while received < length:
+                    data = stream.read(min(READ_SIZE, length - received))
+                    if not data:
+                        break
+                    sha.update(data)
+                    f.write(data)
+                    received += len(data)
+                if received != length:
+                    raise UploadError("分块不完整", 400, offset)
+                if sha.hexdigest() != checksum.lower():
+                    raise UploadError("分块校验失败", 400, offset)
+            except Exception:
+                f.truncate(offset)
+                raise
+        state["offset"] = offset + length
+        _save(upload_id, state)
+        return state["offset"]
+    finally:
+        rd.delete(LOCK_KEY.format(upload_id))
+
+
+def finalize(upload_id, admin_id, store):
+    """
+    全部分块接收完成后调用 store(临时文件, 原文件名) 保存文件（临时文件由 store 移走）；返回保存的文件名。
+    交给 store 的是分块文件的硬链接，保存成功后才删除分块文件，保存失败时可以重试
+    """
+    if not rd.set(LOCK_KEY.format(upload_id), 1, nx=True, ex=300):
+        raise UploadError("该上传正在处理", 409)
+    try:
+        state = _load(upload_id, admin_id)
+        if state["done"]:
+            return state["done"]
+        if state["offset"] != state["size"]:
+            raise UploadError("文件尚未上传完成", 409, state["offset"])
+        path = _partial_path(upload_id)
+        if os.path.getsize(path) != state["size"]:
+            raise UploadError("文件大小不一致", 409, os.path.getsize(path))
+        tmp = path + ".finalize"
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        try:
+            name = store(tmp, state["filename"])
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        state["done"] = name
+        _save(upload_id, state)
+        os.remove(path)
+        return name
+    finally:
+        rd.delete(LOCK_KEY.format(upload_id))
+
+
+def claim(upload_id, admin_id, field):
+    """
+    提交表单时取出已完成上传的文件名（只能使用一次）；上传不存在或未完成时返回 None
+    """
+    try:
+        state = _load(upload_id, admin_id)
+    except UploadError:
+        return None
+    if state["field"] != field or not state["done"]:
+        return None
+    rd.delete(STATE_KEY.format(upload_id))
+    return state["done"]
+
+
+def cleanup(max_age=STATE_TIMEOUT):
+    """
+    删除超过 max_age 秒未完成的临时文件，返回删除的个数
+    """
+    directory = os.path.join(app.config["UP_DIR"], PARTIAL_DIR)
+    if not os.path.isdir(directory):
+        return 0
+    num = 0
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if now - os.path.getmtime(path) > max_age and not rd.exists(STATE_KEY.format(name)):
+            os.remove(path)
+            num += 1
+    return num
@@ -0,0 +1,183 @@
+import json
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+
+from app import db, rd
+from app.models import SensitiveWord
+
+__author__ = "TuDi"
+__date__ = "2026/10/19 上午0:10"
+
+# 命中敏感词后的处理方式，同一条内容命中多个词时取最严格的
+MASK = 1  # 替换为 *
+FLAG = 2  # 原样保存，记入待审列表
+REJECT = 3  # 拒绝发送
+POLICIES = ((MASK, "替换为*"), (FLAG, "标记待审"), (REJECT, "拒绝发送"))
+
+# 敏感词版本号，后台修改词表后递增，各进程检查到变化后重建自动机
+VERSION_KEY = "sensitive:version"
+CHECK_INTERVAL = 5
+
+# 命中 FLAG 的内容，保留最近的 FLAGGED_MAX 条
+FLAGGED_KEY = "sensitive:flagged"
+FLAGGED_MAX = 1000
+
+Result = namedtuple("Result", "text policy words")
+
+
+class Automaton(object):
+    """
+    Aho–Corasick 多模式匹配自动机，一次扫描找出文本中所有的敏感词，耗时与词表大小无关；
+    匹配不区分大小写
+    """
+
+    def __init__(self, words=()):
+        # goto[状态] 为 {字符: 下一状态}，fail 为失配跳转，out 为在该状态结束的 (词长, 处理方式, 词)
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for word, policy in words:
+            word = (word or "").strip().lower()
+            if word:
+                self._add(word, policy)
+        self._build()
+
+    def _add(self, word, policy):
+        state = 0
+        for ch in word:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            state = nxt
+        self.out[state] += ((len(word), policy, word),)
+
+    def _build(self):
+        # 按层遍历计算失配跳转，并把后缀状态的输出合并进来
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                f = self.goto[f].get(ch, 0)
+                self.fail[nxt] = f if f != nxt else 0
+                self.out[nxt] += self.out[self.fail[nxt]]
+
+    def finditer(self, text):
+        """
+        逐个返回命中的 (起始下标, 结束下标, 处理方式, 词)
+        """
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = text
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for i, ch in enumerate(lowered):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for length, policy, word in out[state]:
+                    yield i + 1 - length, i + 1, policy, word
+
+    def check(self, text):
+        """
+        返回 Result(处理后的文本, 最严格的处理方式, 命中的词)；未命中时处理方式为 0
+        """
+        if not text or len(self.goto) == 1:
+            return Result(text, 0, [])
+        policy = 0
+        words = []
+        masked = None
+        for start, end, p, word in self.finditer(text):
+            policy = max(policy, p)
+            words.append(word)
+            if p == MASK:
+                if masked is None:
+                    masked = list(text)
+                masked[start:end] = "*" * (end - start)
+        return Result("".join(masked) if masked is not None else text, policy, words)
+
+
+class WordFilter(object):
+    def __init__(self):
+        self.automaton = None
+        self.version = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def get_automaton(self):
+        now = time.time()
+        if self.automaton is None or now - self.checked_at > CHECK_INTERVAL:
+            with self.lock:
+                if self.automaton is None or now - self.checked_at > CHECK_INTERVAL:
+                    version = int(rd.get(VERSION_KEY) or 0)
+                    if version != self.version:
+                        rows = db.session.query(SensitiveWord.word, SensitiveWord.policy).all()
+                        self.automaton = Automaton(rows)
+                        self.version = version
+                    self.checked_at = now
+        return self.automaton
+
+
+word_filter = WordFilter()
+
+
+def check(text):
+    return word_filter.get_automaton().check(text)
+
+
+def bump():
+    """
+    词表变化后调用，各进程在 CHECK_INTERVAL 秒内重建自动机
+    """
+    rd.incr(VERSION_KEY)
+
+
+def flag(kind, ref, movie_id, text, words):
+    """
+    记录一条命中 FLAG 的内容（评论或弹幕）供后台审核
+    """
+    pipe = rd.pipeline()
+    pipe.lpush(FLAGGED_KEY, json.dumps(dict(
+        kind=kind,
+        ref=ref,
+        movie_id=movie_id,
+        text=text,
+        words=sorted(set(words)),
+        add_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    )))
+    pipe.ltrim(FLAGGED_KEY, 0, FLAGGED_MAX - 1)
+    pipe.execute()
+
+
+def flagged(start=0, num=50):
+    return [json.loads(item.decode("utf8")) for item in rd.lrange(FLAGGED_KEY, start, start + num - 1)]
+
+
+def benchmark(num_words=5000, num_messages=100000, length=30):
+    """
+    用随机生成的词表和消息测试单核匹配速度，返回 (建自动机秒数, 每秒处理的消息数)
+    """
+    chars = [chr(c) for c in range(0x4e00, 0x4e00 + 500)] + list("abcdefghijklmnopqrstuvwxyz")
+    words = [
+        ("".join(random.choice(chars) for _ in range(random.randint(2, 4))), random.choice((MASK, FLAG, REJECT)))
+        for _ in range(num_words)
+    ]
+    messages = ["".join(random.choice(chars) for _ in range(length)) for _ in range(num_messages)]
+    start = time.time()
+    automaton = Automaton(words)
+    built = time.time() - start
+    start = time.time()
+    for message in messages:
+        automaton.check(message)
+    return built, num_messages / (time.time() - start)
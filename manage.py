@@ -1,7 +1,313 @@
+import sys
+
 from app import app
 __author__ = "TuDi"
 __date__ = "2018/3/29 下午11:41"
 
 
+def reconcile_facets():
+    """
+    全量重新统计首页筛选栏的标签/星级计数，可配合 crontab 定期执行
+    """
+    from app import facets
+    data = facets.reconcile()
+    print("reconciled %d facets" % len(data))
+
+
+def rebuild_search():
+    """
+    重建电影搜索的倒排索引
+    """
+    from app import fulltext
+    print("indexed %d movies" % fulltext.rebuild())
+
+
+def flush_play_counts():
+    """
+    立即把 Redis 中累计的播放量写回数据库
+    """
+    from app import counters
+    print("flushed %d movies" % counters.flush())
+
+
+def check_queries(admin_id=1, user_id=1):
+    """
+    检查各列表页执行的 SQL 条数是否符合预期（发现 N+1 查询）
+    """
+    from app.sqlcount import check_views, EXPECTED_QUERIES
+    failures = check_views(int(admin_id), int(user_id))
+    for endpoint, num, statements in failures:
+        print("%s: expected %d SQL statements, got %d" % (endpoint, num, len(statements)))
+        for statement in statements:
+            print("    " + " ".join(statement.split()))
+    print("%d/%d views ok" % (len(EXPECTED_QUERIES) - len(failures), len(EXPECTED_QUERIES)))
+    if failures:
+        sys.exit(1)
+
+
+def migrate_danmaku():
+    """
+    把所有旧版弹幕列表迁移到按播放时间索引的有序集合（读取时也会自动迁移）
+    """
+    from app import rd, danmaku
+    num = 0
+    for key in rd.scan_iter(match=danmaku.LIST_KEY.format("*"), count=1000):
+        movie_id = key.decode()[len(danmaku.LIST_KEY.format("")):]
+        if movie_id.isdigit():
+            num += danmaku.migrate(movie_id)
+    print("migrated %d danmaku" % num)
+
+
+def encode_danmaku():
+    """
+    把已有的 JSON 弹幕转换为紧凑编码
+    """
+    from app import rd, danmaku
+    num = 0
+    for key in rd.scan_iter(match=danmaku.ZSET_KEY.format("*"), count=1000):
+        movie_id = key.decode()[len(danmaku.ZSET_KEY.format("")):]
+        if movie_id.isdigit():
+            num += danmaku.convert(movie_id)
+    print("encoded %d danmaku" % num)
+
+
+def danmaku_memory_report(num=100000):
+    """
+    用模拟数据比较 JSON 和紧凑编码两种弹幕格式占用的 Redis 内存
+    """
+    from app import danmaku
+    report = danmaku.memory_report(int(num))
+    for name in ("json", "compact"):
+        print("%-8s payload %10d bytes  redis %s bytes" % (
+            name, report[name]["bytes"], report[name]["memory"] or "n/a"
+        ))
+    if report["json"]["memory"] and report["compact"]["memory"]:
+        print("compact / json: %.1f%%" % (100.0 * report["compact"]["memory"] / report["json"]["memory"]))
+
+
+def _danmaku_movies():
+    from app import rd, danmaku
+    prefix = danmaku.ZSET_KEY.format("")
+    for key in rd.scan_iter(match=danmaku.ZSET_KEY.format("*"), count=1000):
+        movie_id = key.decode()[len(prefix):]
+        if movie_id.isdigit():
+            yield movie_id
+
+
+def set_danmaku_retention(movie_id, max_count="", max_age=""):
+    """
+    设置单部电影的弹幕保留条数和秒数（0 为不限，留空恢复默认值），并立即按新策略淘汰
+    """
+    from app import danmaku
+    danmaku.set_retention(
+        movie_id,
+        int(max_count) if max_count != "" else None,
+        int(max_age) if max_age != "" else None
+    )
+    print("evicted %d danmaku" % danmaku.trim(movie_id))
+
+
+def rebuild_danmaku_log():
+    """
+    为保留策略上线前写入的弹幕重建写入顺序日志
+    """
+    from app import danmaku
+    num = sum(danmaku.rebuild_log(movie_id) for movie_id in _danmaku_movies())
+    print("logged %d danmaku" % num)
+
+
+def export_danmaku(movie_id, path, fmt=""):
+    """
+    把一部电影的弹幕导出到文件，格式为 xml 或 json（默认按扩展名判断）
+    """
+    from app import danmaku_io
+    fmt = fmt or danmaku_io.guess_format(path)
+    with open(path, "wb") as f:
+        for chunk in danmaku_io.export(movie_id, fmt):
+            f.write(chunk.encode("utf8"))
+    print("wrote %s" % path)
+
+
+def import_danmaku(movie_id, path, fmt=""):
+    """
+    从 xml 或 json 文件导入弹幕到一部电影（默认按扩展名判断格式）
+    """
+    from app import danmaku_io
+    with open(path, "rb") as f:
+        num = danmaku_io.import_file(movie_id, f, fmt or danmaku_io.guess_format(path))
+    print("imported %d danmaku" % num)
+
+
+def rebuild_danmaku_histogram():
+    """
+    按现有弹幕重建所有电影的弹幕密度直方图
+    """
+    from app import danmaku
+    num = sum(danmaku.rebuild_histogram(movie_id) for movie_id in _danmaku_movies())
+    print("counted %d danmaku" % num)
+
+
+def trim_danmaku():
+    """
+    按保留策略淘汰所有电影的过期弹幕并写入 MySQL 归档，可配合 crontab 定期执行
+    """
+    from app import danmaku
+    num = sum(danmaku.trim(movie_id) for movie_id in _danmaku_movies())
+    print("evicted %d danmaku, archived %d" % (num, danmaku.archive()))
+
+
+def benchmark_wordfilter(num_words=5000, num_messages=100000):
+    """
+    测试敏感词自动机在单核上每秒能处理的消息数
+    """
+    from app import wordfilter
+    built, rate = wordfilter.benchmark(int(num_words), int(num_messages))
+    print("%s words: built in %.3fs, %.0f messages/s" % (num_words, built, rate))
+
+
+def benchmark_media(filename="", num=200):
+    """
+    对上传目录中的视频发起随机区间请求，测量拖动进度条的延迟；不指定文件时临时生成一个 2GB 的稀疏文件
+    """
+    import os
+    import uuid
+    from flask import url_for
+    from app import media
+    created = not filename
+    if created:
+        filename = "benchmark-%s.mp4" % uuid.uuid4().hex
+        with open(os.path.join(app.config["UP_DIR"], filename), "wb") as f:
+            f.truncate(2 * 1024 ** 3)
+    path = os.path.join(app.config["UP_DIR"], filename)
+    try:
+        with app.test_request_context():
+            url = url_for("home.media_file", filename=filename)
+        avg, p50, p99 = media.benchmark(app.test_client(), url, os.path.getsize(path), int(num))
+        print("%d seeks on %s: avg %.2fms  p50 %.2fms  p99 %.2fms" % (int(num), filename, avg, p50, p99))
+    finally:
+        if created:
+            os.remove(path)
+
+
+def faststart_movies():
+    """
+    对已上传的 MP4 做 faststart 改写，并补全电影的时长、分辨率和码率
+    """
+    import os
+    from app import db, mp4, storage
+    from app.models import Movie
+    num = 0
+    for movie in Movie.query.all():
+        if storage.is_addressed(movie.url):
+            # 按内容保存的文件不能原地改写，改写后按新内容保存
+            movie.url = storage.rewrite(movie.url, mp4.prepare)
+            meta = mp4.read_meta(storage.path(movie.url))
+        else:
+            meta = mp4.process(os.path.join(app.config["UP_DIR"], movie.url))
+        if not meta:
+            continue
+        movie.duration = meta["duration"]
+        movie.width = meta["width"]
+        movie.height = meta["height"]
+        movie.bitrate = meta["bitrate"]
+        if meta["duration"] and not movie.length:
+            movie.length = mp4.format_length(meta["duration"])
+        db.session.add(movie)
+        db.session.commit()
+        num += 1
+    print("processed %d movies" % num)
+
+
+def cleanup_uploads():
+    """
+    删除过期未完成的分块上传临时文件
+    """
+    from app import uploads
+    print("removed %d partial uploads" % uploads.cleanup())
+
+
+def migrate_uploads():
+    """
+    把按时间戳命名的上传文件改为按内容保存（ab/cd/<sha256>.<扩展名>），内容相同的文件只保留一份；
+    完成后按数据库重新计算引用数。可重复执行
+    """
+    import os
+    from app import db, storage
+    from app.models import Movie, Preview, User
+    columns = [(Movie, "url", ""), (Movie, "logo", ""), (Preview, "logo", ""), (User, "face", storage.USERS)]
+    num = 0
+    for model, column, folder in columns:
+        for row in model.query.all():
+            old = getattr(row, column)
+            new = storage.migrate(old, folder)
+            if new == old:
+                continue
+            setattr(row, column, new)
+            db.session.add(row)
+            db.session.commit()
+            os.remove(storage.path(old, folder))
+            num += 1
+    files, orphans = storage.reconcile()
+    print("migrated %d files, %d stored files referenced, %d unreferenced" % (num, files, orphans))
+
+
+def reconcile_uploads(remove_orphans=""):
+    """
+    按数据库重新计算上传文件的引用数；remove_orphans=1 时删除一天以上没有引用的文件
+    """
+    from app import storage
+    files, orphans = storage.reconcile(remove_orphans == "1")
+    print("%d stored files referenced, %d unreferenced" % (files, orphans))
+
+
+def generate_thumbs():
+    """
+    为已上传的封面、预告图片和头像补全缩略图（需要 Pillow）
+    """
+    from app import storage, thumbs
+    from app.models import Movie, Preview, User
+    if thumbs.Image is None:
+        sys.exit("Pillow is not installed")
+    futures = [thumbs.generate(logo, "poster") for logo, in Movie.query.with_entities(Movie.logo)]
+    futures += [thumbs.generate(logo, "preview") for logo, in Preview.query.with_entities(Preview.logo)]
+    futures += [thumbs.generate(face, "avatar", storage.USERS) for face, in User.query.with_entities(User.face)]
+    num = 0
+    for future in futures:
+        if future is not None:
+            num += future.result()
+    print("generated %d thumbnails" % num)
+
+
+# python manage.py <命令> [参数...]，不带命令时启动开发服务器
+commands = dict(
+    reconcile_facets=reconcile_facets,
+    rebuild_search=rebuild_search,
+    flush_play_counts=flush_play_counts,
+    check_queries=check_queries,
+    migrate_danmaku=migrate_danmaku,
+    encode_danmaku=encode_danmaku,
+    danmaku_memory_report=danmaku_memory_report,
+    set_danmaku_retention=set_danmaku_retention,
+    rebuild_danmaku_log=rebuild_danmaku_log,
+    trim_danmaku=trim_danmaku,
+    rebuild_danmaku_histogram=rebuild_danmaku_histogram,
+    export_danmaku=export_danmaku,
+    import_danmaku=import_danmaku,
+    benchmark_wordfilter=benchmark_wordfilter,
+    benchmark_media=benchmark_media,
+    faststart_movies=faststart_movies,
+    cleanup_uploads=cleanup_uploads,
+    migrate_uploads=migrate_uploads,
+    reconcile_uploads=reconcile_uploads,
+    generate_thumbs=generate_thumbs,
+)
+
+
 if __name__ == '__main__':
-    app.run(port=5001)
+    if len(sys.argv) > 1:
+        if sys.argv[1] not in commands:
+            sys.exit("unknown command %s, available: %s" % (sys.argv[1], ", ".join(sorted(commands))))
+        with app.app_context():
+            commands[sys.argv[1]](*sys.argv[2:])
+    else:
+        app.run(port=5001)